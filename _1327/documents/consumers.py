@@ -1,23 +1,116 @@
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
 
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import close_old_connections
 
-class PreviewConsumer(WebsocketConsumer):
+from _1327.documents.models import Document
+from _1327.documents.preview import get_cached_preview, get_full_preview_message, get_preview_event, get_preview_state, update_preview
+from _1327.main.utils import render_markdown
+from _1327.user_management.shortcuts import check_permissions
 
-	def connect(self):
+
+# markdown is rendered in these threads, so that the event loop is never blocked and at most this many texts are rendered at once
+render_executor = ThreadPoolExecutor(max_workers=settings.PREVIEW_RENDER_THREADS, thread_name_prefix='preview')
+
+
+def render_preview(hash_value, language, text):
+	"""
+		renders the text and stores it as the current preview,
+		returns the rendered text and the message for the watchers of the preview (None if the preview did not change)
+	"""
+	close_old_connections()
+	try:
+		rendered_text = get_cached_preview(hash_value, language, text)
+		if rendered_text is not None:
+			return rendered_text, None
+		rendered_text, __ = render_markdown(text)
+		return rendered_text, update_preview(hash_value, language, text, rendered_text)
+	finally:
+		close_old_connections()
+
+
+class PreviewConsumer(AsyncWebsocketConsumer):
+	"""
+		Everybody who knows the hash of a document can watch its preview.
+		Editors of the document send their text to the consumer, which renders it, replies with the rendered text
+		and sends the changed blocks to all watchers.
+	"""
+
+	async def connect(self):
 		self.group_name = self.scope['url_route']['kwargs']['hash_value']
-		async_to_sync(self.channel_layer.group_add)(
+		self.can_render = None
+		# the latest text of every language that is waiting to be rendered
+		self.pending_texts = {}
+		self.render_tasks = {}
+		await self.channel_layer.group_add(
 			self.group_name,
 			self.channel_name,
 		)
 
-		self.accept()
+		await self.accept()
 
-	def disconnect(self, messsage, **kwargs):
-		async_to_sync(self.channel_layer.group_discard)(
+	async def disconnect(self, message, **kwargs):
+		for task in self.render_tasks.values():
+			task.cancel()
+		await self.channel_layer.group_discard(
 			self.group_name,
 			self.channel_name,
 		)
 
-	def update_preview(self, event):
-		self.send(text_data=event['message'])
+	async def receive(self, text_data=None, bytes_data=None):
+		data = json.loads(text_data)
+		language = data.get('language', '')
+		if 'text' not in data:
+			# watchers that missed a change of the preview ask for all of its blocks
+			state = await database_sync_to_async(get_preview_state)(self.group_name, language)
+			if state is not None:
+				await self.send(text_data=get_full_preview_message(state, language))
+			return
+
+		if self.can_render is None:
+			self.can_render = await self.check_render_permission()
+		if not self.can_render:
+			await self.close()
+			return
+
+		# texts that arrive while an older one is rendered replace each other, only the latest one is rendered
+		self.pending_texts[language] = data['text']
+		if language not in self.render_tasks:
+			self.render_tasks[language] = asyncio.ensure_future(self.render_pending_texts(language))
+
+	async def render_pending_texts(self, language):
+		try:
+			while language in self.pending_texts:
+				text = self.pending_texts.pop(language)
+				rendered_text, message = await asyncio.get_event_loop().run_in_executor(
+					render_executor, render_preview, self.group_name, language, text,
+				)
+				await self.send(text_data=json.dumps({
+					'language': language,
+					'rendered_text': rendered_text,
+				}))
+				if message is not None:
+					await self.channel_layer.group_send(self.group_name, get_preview_event(message))
+		finally:
+			del self.render_tasks[language]
+
+	@database_sync_to_async
+	def check_render_permission(self):
+		document = Document.objects.filter(hash_value=self.group_name).first()
+		if document is None:
+			return False
+		if not document.has_perms():
+			return True
+		try:
+			check_permissions(document, self.scope['user'], [document.view_permission_name, document.edit_permission_name])
+		except PermissionDenied:
+			return False
+		return True
+
+	async def update_preview(self, event):
+		await self.send(text_data=event['message'])
@@ -0,0 +1,67 @@
+from difflib import SequenceMatcher
+import json
+
+from reversion.models import Version
+
+from _1327.documents.models import Document, VersionDiff
+from _1327.documents.search import TEXT_FIELDS
+from _1327.documents.version_storage import get_version_texts
+
+
+def get_line_changes(old_text, new_text):
+	"""
+		returns the lines that differ between the texts
+		as a list of [old start, old lines, new start, new lines]
+	"""
+	old_lines = old_text.splitlines()
+	new_lines = new_text.splitlines()
+	matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+	return [
+		[old_start, old_lines[old_start:old_end], new_start, new_lines[new_start:new_end]]
+		for operation, old_start, old_end, new_start, new_end in matcher.get_opcodes()
+		if operation != 'equal'
+	]
+
+
+def get_previous_version(version):
+	return Version.objects.get_for_object_reference(version._model, version.object_id).filter(pk__lt=version.pk).first()
+
+
+def create_version_diffs(versions):
+	"""
+		stores the changes of the texts of the document versions compared to the previous versions of their documents
+	"""
+	version_diffs = []
+	for version in versions:
+		previous_version = get_previous_version(version)
+		previous_texts = get_version_texts(previous_version) if previous_version is not None else dict.fromkeys(TEXT_FIELDS, '')
+		texts = get_version_texts(version)
+		changes = {field: get_line_changes(previous_texts[field], texts[field]) for field in TEXT_FIELDS}
+		version_diffs.append(VersionDiff(version=version, previous_version=previous_version, changes=json.dumps(changes)))
+	VersionDiff.objects.bulk_create(version_diffs, ignore_conflicts=True)
+	return version_diffs
+
+
+def create_revision_diffs(versions):
+	"""
+		stores the changes of the documents that are part of a revision
+	"""
+	document_versions = {}
+	for version in versions:
+		if not issubclass(version._model, Document):
+			continue
+		# revisions of document subclasses contain a version of their parent document as well,
+		# the version history shows the versions of the subclass
+		if version.object_id not in document_versions or version._model is not Document:
+			document_versions[version.object_id] = version
+	return create_version_diffs(document_versions.values())
+
+
+def get_version_diff(version):
+	"""
+		returns the changes of the version, versions created before the changes were stored get their changes now
+	"""
+	try:
+		return version.diff
+	except VersionDiff.DoesNotExist:
+		return create_version_diffs([version])[0]
@@ -1,11 +1,29 @@
 import markdown
+from markdown.preprocessors import Preprocessor
 
 from _1327.documents.models import Document
 from _1327.polls.models import Poll
 
 
+class InternalLinksPreprocessor(Preprocessor):
+
+	def __init__(self, md, link_patterns):
+		super().__init__(md)
+		self.link_patterns = link_patterns
+
+	def run(self, lines):
+		text = "\n".join(lines)
+		for link_pattern in self.link_patterns:
+			link_pattern.prefetch(text)
+		return lines
+
+
 class InternalLinksMarkdownExtension(markdown.extensions.Extension):
 
 	def extendMarkdown(self, md):
-		md.inlinePatterns.register(Document.LinkPattern(Document.DOCUMENT_LINK_REGEX, md), 'InternalLinkDocumentsPattern', 200)
-		md.inlinePatterns.register(Poll.LinkPattern(Poll.POLLS_LINK_REGEX, md), 'InternalLinkPollsPattern', 200)
+		document_link_pattern = Document.LinkPattern(Document.DOCUMENT_LINK_REGEX, md)
+		poll_link_pattern = Poll.LinkPattern(Poll.POLLS_LINK_REGEX, md)
+		md.inlinePatterns.register(document_link_pattern, 'InternalLinkDocumentsPattern', 200)
+		md.inlinePatterns.register(poll_link_pattern, 'InternalLinkPollsPattern', 200)
+		# run after all other preprocessors so that the final text is scanned for links
+		md.preprocessors.register(InternalLinksPreprocessor(md, [document_link_pattern, poll_link_pattern]), 'InternalLinksPrefetch', 0)
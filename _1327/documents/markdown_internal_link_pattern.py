@@ -1,4 +1,3 @@
-from django.core.exceptions import ObjectDoesNotExist
 from django.utils.translation import gettext_lazy as _
 
 import markdown
@@ -7,14 +6,33 @@ from markdown.inlinepatterns import LinkInlineProcessor
 
 class InternalLinkPattern(LinkInlineProcessor):
 
+	def __init__(self, pattern, md=None):
+		super().__init__(pattern, md)
+		self.urls = {}
+
+	def prefetch(self, text):
+		# resolve all links of the text at once instead of querying every linked object on its own
+		ids = {int(match.group('id')) for match in self.compiled_re.finditer(text)}
+		self.urls = dict.fromkeys(ids)
+		if ids:
+			self.urls.update(self.resolve(ids))
+
 	def handleMatch(self, m, data=None):
 		el = markdown.util.etree.Element("a")
-		try:
-			el.set('href', self.url(m.group('id')))
+		id = int(m.group('id'))
+		if id not in self.urls:
+			self.urls[id] = self.resolve([id]).get(id)
+
+		url = self.urls[id]
+		if url is not None:
+			el.set('href', url)
 			el.text = markdown.util.AtomicString(m.group('title'))
-		except ObjectDoesNotExist:
+		else:
 			el.text = markdown.util.AtomicString(_('[missing link]'))
 		return el, m.start(0), m.end(0)
 
-	def url(id):
+	def resolve(self, ids):
+		"""
+			returns a dict mapping the ids of all existing objects to their urls
+		"""
 		raise NotImplementedError
@@ -0,0 +1,42 @@
+# Generated by Django 3.0.14 on 2026-10-18 01:59
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+DOCUMENT_LINK_REGEX = r'\[(?P<title>[^\[]+)\]\(document:(?P<id>\d+)\)'
+
+
+def fill_document_links(apps, schema_editor):
+    Document = apps.get_model("documents", "Document")
+    DocumentLink = apps.get_model("documents", "DocumentLink")
+    existing_ids = set(Document.objects.values_list('id', flat=True))
+    links = []
+    for document in Document.objects.only('id', 'text_de', 'text_en').iterator():
+        linked_ids = {int(match.group('id')) for text in (document.text_de, document.text_en) for match in re.finditer(DOCUMENT_LINK_REGEX, text)}
+        links.extend(DocumentLink(source_id=document.id, target_id=target_id) for target_id in linked_ids & existing_ids)
+    DocumentLink.objects.bulk_create(links, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0015_auto_20200224_1847'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentLink',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outgoing_links', to='documents.Document')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='incoming_links', to='documents.Document')),
+            ],
+            options={
+                'unique_together': {('source', 'target')},
+            },
+        ),
+        migrations.RunPython(fill_document_links, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.0.14 on 2026-10-18 02:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('documents', '0016_document_links'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentRevisionInfo',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='revision_info', serialize=False, to='documents.Document')),
+                ('last_change', models.DateTimeField(db_index=True)),
+                ('revision_count', models.PositiveIntegerField(default=0)),
+                ('last_author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
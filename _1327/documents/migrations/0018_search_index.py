@@ -0,0 +1,45 @@
+from django.db import migrations
+
+# the index is created with the fields that existed when this migration was written,
+# later changes of the search backends in documents/search.py need their own migrations
+INDEXED_FIELDS = ('title_de', 'title_en', 'text_de', 'text_en')
+
+
+def sqlite_supports_trigram_index():
+    from sqlite3 import sqlite_version_info
+    # the trigram tokenizer is available since SQLite 3.34
+    return sqlite_version_info >= (3, 34)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite' and sqlite_supports_trigram_index():
+        schema_editor.execute('CREATE VIRTUAL TABLE documents_search_index USING fts5({}, tokenize="trigram")'.format(', '.join(INDEXED_FIELDS)))
+        schema_editor.execute('INSERT INTO documents_search_index (rowid, {0}) SELECT id, {0} FROM documents_document'.format(', '.join(INDEXED_FIELDS)))
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for field in INDEXED_FIELDS:
+            # case-insensitive lookups compare the upper case values
+            schema_editor.execute(
+                'CREATE INDEX documents_document_{0}_trgm ON documents_document USING gin (UPPER({0}::text) gin_trgm_ops)'.format(field)
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS documents_search_index')
+    elif vendor == 'postgresql':
+        for field in INDEXED_FIELDS:
+            schema_editor.execute('DROP INDEX IF EXISTS documents_document_{}_trgm'.format(field))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0017_document_revision_info'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, reverse_code=drop_search_index),
+    ]
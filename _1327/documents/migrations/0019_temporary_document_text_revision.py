@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 02:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0018_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='temporarydocumenttext',
+            name='revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
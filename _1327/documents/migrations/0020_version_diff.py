@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-18 02:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reversion', '0001_squashed_0004_auto_20160611_1202'),
+        ('documents', '0019_temporary_document_text_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionDiff',
+            fields=[
+                ('version', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='diff', serialize=False, to='reversion.Version')),
+                ('changes', models.TextField()),
+                ('previous_version', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='reversion.Version')),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.14 on 2026-10-18 02:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reversion', '0001_squashed_0004_auto_20160611_1202'),
+        ('documents', '0020_version_diff'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionTextDelta',
+            fields=[
+                ('version', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='text_delta', serialize=False, to='reversion.Version')),
+                ('chain_length', models.PositiveIntegerField()),
+                ('changes', models.BinaryField()),
+                ('base_version', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='reversion.Version')),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.0.14 on 2026-10-18 03:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reversion', '0001_squashed_0004_auto_20160611_1202'),
+        ('documents', '0021_version_text_delta'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='versiontextdelta',
+            name='base_version',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='reversion.Version'),
+        ),
+    ]
@@ -3,6 +3,7 @@ import hashlib
 import re
 
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
 from django.urls import reverse
 from django.utils import timezone
@@ -45,15 +46,22 @@ class Document(PolymorphicModel):
 		verbose_name_plural = _("Documents")
 
 	class LinkPattern(InternalLinkPattern):
-		def url(self, id):
-			document = Document.objects.get(id=id)
-			if document:
-				return reverse(document.get_view_url_name(), args=[document.url_title])
-			return ''
+		def resolve(self, ids):
+			return {
+				document.id: reverse(document.get_view_url_name(), args=[document.url_title])
+				for document in Document.objects.filter(id__in=ids)
+			}
 
 	def __str__(self):
 		return f"{self.title_de} | {self.title_en}"
 
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		instance = super().from_db(db, field_names, values)
+		# remember the loaded url_title to detect changes of link targets on save
+		instance._loaded_url_title = dict(zip(field_names, values)).get('url_title')
+		return instance
+
 	def save(self, *args, **kwargs):
 		# make sure that the url is slugified
 		self.url_title = slugify(self.url_title)
@@ -99,7 +107,7 @@ class Document(PolymorphicModel):
 
 	def authors(self):
 		authors = set()
-		versions = Version.objects.get_for_object(self)
+		versions = Version.objects.get_for_object(self).select_related('revision__user')
 		for version in versions:
 			authors.add(version.revision.user)
 		return authors
@@ -168,19 +176,32 @@ class Document(PolymorphicModel):
 	def meta_information_html(self):
 		raise NotImplementedError('Please use a subclass of Document')
 
+	def get_revision_info(self):
+		try:
+			return self.revision_info
+		except ObjectDoesNotExist:
+			return None
+
 	@property
 	def last_change(self):
-		last_revision = Version.objects.get_for_object(self).order_by('revision__date_created').last()
-		if last_revision is None:
+		revision_info = self.get_revision_info()
+		if revision_info is None:
 			return None
-		return last_revision.revision.date_created
+		return revision_info.last_change
 
 	@property
 	def last_author(self):
-		last_revision = Version.objects.get_for_object(self).order_by('revision__date_created').last()
-		if last_revision is None:
+		revision_info = self.get_revision_info()
+		if revision_info is None:
 			return None
-		return last_revision.revision.user
+		return revision_info.last_author
+
+	@property
+	def revision_count(self):
+		revision_info = self.get_revision_info()
+		if revision_info is None:
+			return 0
+		return revision_info.revision_count
 
 	@property
 	def is_in_creation(self):
@@ -205,6 +226,63 @@ class Document(PolymorphicModel):
 	def handle_edit(self, cleaned_data):
 		pass
 
+	def update_links(self):
+		"""
+			updates the index of documents that are linked in the texts of this document
+		"""
+		linked_ids = {int(match.group('id')) for text in (self.text_de, self.text_en) for match in re.finditer(self.DOCUMENT_LINK_REGEX, str(text))}
+		self.outgoing_links.exclude(target_id__in=linked_ids).delete()
+		new_ids = linked_ids - set(self.outgoing_links.values_list('target_id', flat=True))
+		if new_ids:
+			DocumentLink.objects.bulk_create([
+				DocumentLink(source=self, target_id=target_id)
+				for target_id in Document.objects.filter(id__in=new_ids).values_list('id', flat=True)
+			])
+
+
+class DocumentRevisionInfo(models.Model):
+	"""
+		information about the revisions of a document, kept up to date whenever a revision is created
+		so that it does not have to be computed from all versions of the document
+	"""
+	document = models.OneToOneField(Document, primary_key=True, on_delete=models.CASCADE, related_name='revision_info')
+	last_change = models.DateTimeField(db_index=True)
+	last_author = models.ForeignKey(UserProfile, blank=True, null=True, on_delete=models.SET_NULL, related_name='+')
+	revision_count = models.PositiveIntegerField(default=0)
+
+
+class VersionDiff(models.Model):
+	"""
+		the changed lines of the texts of a document version compared to the previous version of the document,
+		stored when the version is created so that the version history does not need the full texts
+	"""
+	version = models.OneToOneField(Version, primary_key=True, on_delete=models.CASCADE, related_name='diff')
+	previous_version = models.ForeignKey(Version, blank=True, null=True, on_delete=models.SET_NULL, related_name='+')
+	# json object mapping the text fields to their changes
+	changes = models.TextField()
+
+
+class VersionTextDelta(models.Model):
+	"""
+		the texts of a document version that are stored as compressed changes to the texts of the previous version,
+		the serialized data of the version keeps empty texts
+	"""
+	version = models.OneToOneField(Version, primary_key=True, on_delete=models.CASCADE, related_name='text_delta')
+	# the texts of the version are reconstructed from the texts of the base version,
+	# which are restored before the base version is deleted, see restore_texts_of_dependent_versions
+	base_version = models.ForeignKey(Version, on_delete=models.CASCADE, related_name='+')
+	# number of deltas that have to be applied to the last version with full texts
+	chain_length = models.PositiveIntegerField()
+	changes = models.BinaryField()
+
+
+class DocumentLink(models.Model):
+	source = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='outgoing_links')
+	target = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='incoming_links')
+
+	class Meta:
+		unique_together = ('source', 'target')
+
 
 class TemporaryDocumentText(models.Model):
 	text_de = models.TextField(blank=True)
@@ -212,6 +290,10 @@ class TemporaryDocumentText(models.Model):
 	document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='document')
 	created = models.DateTimeField(auto_now=True)
 	author = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='temporary_documents')
+	# counts the changes of the texts, changes sent by the editor refer to it
+	revision = models.PositiveIntegerField(default=0)
+
+	AUTOSAVED_FIELDS = ('text_de', 'text_en')
 
 
 class Attachment(models.Model):
@@ -0,0 +1,192 @@
+from difflib import SequenceMatcher
+import hashlib
+from html.parser import HTMLParser
+import json
+import time
+
+from asgiref.sync import async_to_sync
+import channels.layers
+from django.conf import settings
+from django.core.cache import cache
+
+
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+
+class BlockParser(HTMLParser):
+	"""
+		finds the offsets at which the top-level elements of an html fragment end
+	"""
+
+	def __init__(self, html):
+		super().__init__(convert_charrefs=False)
+		self.html = html
+		self.depth = 0
+		self.block_ends = []
+		self.line_offsets = [0]
+		for line in html.splitlines(keepends=True):
+			self.line_offsets.append(self.line_offsets[-1] + len(line))
+
+	def get_offset(self):
+		line, column = self.getpos()
+		return self.line_offsets[line - 1] + column
+
+	def end_block_after_starttag(self):
+		self.block_ends.append(self.get_offset() + len(self.get_starttag_text()))
+
+	def handle_starttag(self, tag, attrs):
+		if tag in VOID_ELEMENTS:
+			if self.depth == 0:
+				self.end_block_after_starttag()
+		else:
+			self.depth += 1
+
+	def handle_startendtag(self, tag, attrs):
+		if self.depth == 0:
+			self.end_block_after_starttag()
+
+	def handle_endtag(self, tag):
+		if tag in VOID_ELEMENTS:
+			return
+		self.depth = max(self.depth - 1, 0)
+		if self.depth == 0:
+			# end tags can't contain a '>' before their end
+			self.block_ends.append(self.html.index('>', self.get_offset()) + 1)
+
+
+def split_blocks(html):
+	"""
+		splits rendered markdown into its top-level blocks
+	"""
+	parser = BlockParser(html)
+	parser.feed(html)
+	parser.close()
+
+	blocks = []
+	start = 0
+	for end in parser.block_ends + [len(html)]:
+		block = html[start:end].strip()
+		if block:
+			blocks.append(block)
+		start = end
+	return blocks
+
+
+def get_block_changes(old_blocks, new_blocks):
+	"""
+		returns the changes that turn the old blocks into the new ones
+		as a list of [start, end, replacement blocks], referring to the old blocks
+	"""
+	matcher = SequenceMatcher(None, old_blocks, new_blocks, autojunk=False)
+	return [
+		[old_start, old_end, new_blocks[new_start:new_end]]
+		for operation, old_start, old_end, new_start, new_end in matcher.get_opcodes()
+		if operation != 'equal'
+	]
+
+
+def get_preview_key(hash_value, language):
+	return 'preview_{}_{}'.format(hash_value, language)
+
+
+def get_preview_request_key(hash_value, language):
+	return 'preview_request_{}_{}'.format(hash_value, language)
+
+
+def get_text_digest(text):
+	return hashlib.sha256(text.encode()).hexdigest()
+
+
+def get_preview_version_key(hash_value, language):
+	return 'preview_version_{}_{}'.format(hash_value, language)
+
+
+def increment_counter(key, initial_value):
+	cache.add(key, initial_value, settings.PREVIEW_STATE_TIMEOUT)
+	try:
+		return cache.incr(key)
+	except ValueError:
+		# the key expired right after it was added
+		cache.set(key, initial_value + 1, settings.PREVIEW_STATE_TIMEOUT)
+		return initial_value + 1
+
+
+def register_preview_request(hash_value, language):
+	"""
+		numbers the render requests of a preview, so that requests can find out whether a newer one arrived meanwhile
+	"""
+	return increment_counter(get_preview_request_key(hash_value, language), 0)
+
+
+def allocate_preview_version(hash_value, language):
+	"""
+		returns a new version number for a rendering of the preview. every rendering gets a version of its own,
+		even if several are rendered at once, so that watchers never apply changes to blocks of another rendering
+	"""
+	# start from the current time so that a lost counter never reuses the versions of an older preview
+	return increment_counter(get_preview_version_key(hash_value, language), int(time.time() * 1000))
+
+
+def is_superseded(hash_value, language, request_number):
+	return cache.get(get_preview_request_key(hash_value, language), request_number) > request_number
+
+
+def get_preview_state(hash_value, language):
+	return cache.get(get_preview_key(hash_value, language))
+
+
+def get_cached_preview(hash_value, language, text):
+	"""
+		returns the rendered text if it is the text of the current preview
+	"""
+	state = get_preview_state(hash_value, language)
+	if state is None or state['digest'] != get_text_digest(text):
+		return None
+	return '\n'.join(state['blocks'])
+
+
+def get_full_preview_message(state, language):
+	return json.dumps({
+		'language': language,
+		'version': state['version'],
+		'blocks': state['blocks'],
+	})
+
+
+def update_preview(hash_value, language, text, html):
+	"""
+		stores the rendered text as the current preview
+		and returns the message that tells the watchers of the preview which blocks changed
+	"""
+	blocks = split_blocks(html)
+	old_state = get_preview_state(hash_value, language)
+	state = {
+		'version': allocate_preview_version(hash_value, language),
+		'digest': get_text_digest(text),
+		'blocks': blocks,
+	}
+	cache.set(get_preview_key(hash_value, language), state, settings.PREVIEW_STATE_TIMEOUT)
+
+	if old_state is None:
+		return get_full_preview_message(state, language)
+	return json.dumps({
+		'language': language,
+		'version': state['version'],
+		'base_version': old_state['version'],
+		'changes': get_block_changes(old_state['blocks'], blocks),
+	})
+
+
+def get_preview_event(message):
+	return {
+		'type': 'update_preview',
+		'message': message,
+	}
+
+
+def publish_preview(hash_value, language, text, html):
+	"""
+		sends the changed blocks to everyone who watches the preview
+	"""
+	channel_layer = channels.layers.get_channel_layer()
+	async_to_sync(channel_layer.group_send)(hash_value, get_preview_event(update_preview(hash_value, language, text, html)))
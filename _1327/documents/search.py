@@ -0,0 +1,118 @@
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+
+TITLE_FIELDS = ('title_de', 'title_en')
+TEXT_FIELDS = ('text_de', 'text_en')
+INDEXED_FIELDS = TITLE_FIELDS + TEXT_FIELDS
+
+
+class SearchBackend:
+	"""
+		Finds documents whose fields contain the search phrase.
+		This backend scans the fields with LIKE queries and is used for databases without a search index.
+		Subclasses keep an index of the document fields in the database.
+	"""
+
+	@staticmethod
+	def is_supported(connection):
+		return True
+
+	def index_documents(self, documents):
+		pass
+
+	def delete_document(self, document_id):
+		pass
+
+	def filter(self, queryset, phrase, fields=INDEXED_FIELDS):
+		"""
+			returns the documents of the queryset that contain the phrase in one of the fields,
+			annotated with search_rank (smaller values are better matches)
+		"""
+		return self.filter_contains(queryset, phrase, fields).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+	def filter_contains(self, queryset, phrase, fields):
+		condition = Q()
+		for field in fields:
+			condition |= Q(**{field + '__icontains': phrase})
+		return queryset.filter(condition)
+
+
+class SQLiteSearchBackend(SearchBackend):
+	"""
+		Uses the FTS5 table with the trigram tokenizer created by the migrations, which supports case-insensitive
+		substring matches.
+		Rows of the index use the id of their document as rowid.
+	"""
+	table = 'documents_search_index'
+	# trigrams can't match shorter phrases
+	min_phrase_length = 3
+
+	@classmethod
+	def is_supported(cls, connection):
+		# the migrations only create the index if the SQLite version they ran with supports the trigram tokenizer.
+		# once the index was found it is not looked up again for the connection
+		if not getattr(connection, '_search_index_exists', False):
+			with connection.cursor() as cursor:
+				cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [cls.table])
+				connection._search_index_exists = cursor.fetchone() is not None
+		return connection._search_index_exists
+
+	def index_documents(self, documents):
+		rows = [[document.pk] + [getattr(document, field) for field in INDEXED_FIELDS] for document in documents]
+		with connection.cursor() as cursor:
+			cursor.executemany('DELETE FROM {} WHERE rowid = %s'.format(self.table), [row[:1] for row in rows])
+			cursor.executemany(
+				'INSERT INTO {} (rowid, {}) VALUES (%s, {})'.format(self.table, ', '.join(INDEXED_FIELDS), ', '.join(['%s'] * len(INDEXED_FIELDS))),
+				rows,
+			)
+
+	def delete_document(self, document_id):
+		with connection.cursor() as cursor:
+			cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(self.table), [document_id])
+
+	def filter(self, queryset, phrase, fields=INDEXED_FIELDS):
+		if len(phrase) < self.min_phrase_length:
+			return super().filter(queryset, phrase, fields)
+
+		# the quoted phrase is matched as a substring of one of the fields
+		query = '{{{}}} : "{}"'.format(' '.join(fields), phrase.replace('"', '""'))
+		# the primary key of document subclasses refers to the document, so the rank can be looked up without a join
+		pk_column = '"{}"."{}"'.format(queryset.model._meta.db_table, queryset.model._meta.pk.column)
+		return queryset.filter(
+			pk__in=RawSQL('SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(self.table), [query])
+		).annotate(
+			search_rank=RawSQL(
+				'SELECT rank FROM {0} WHERE {0} MATCH %s AND rowid = {1}'.format(self.table, pk_column),
+				[query],
+				output_field=FloatField(),
+			)
+		)
+
+
+class PostgreSQLSearchBackend(SearchBackend):
+	"""
+		The migrations add trigram indexes to the document fields, which PostgreSQL uses for the LIKE queries of the
+		base backend.
+		Results are ranked by their trigram similarity to the phrase.
+	"""
+
+	def filter(self, queryset, phrase, fields=INDEXED_FIELDS):
+		similarities = ', '.join('word_similarity(%s, documents_document.{})'.format(field) for field in fields)
+		return self.filter_contains(queryset, phrase, fields).annotate(
+			search_rank=RawSQL('-GREATEST({})'.format(similarities), [phrase] * len(fields), output_field=FloatField())
+		)
+
+
+SEARCH_BACKENDS = {
+	'sqlite': SQLiteSearchBackend,
+	'postgresql': PostgreSQLSearchBackend,
+}
+
+
+def get_search_backend(connection=connection):
+	backend = SEARCH_BACKENDS.get(connection.vendor)
+	if backend is None or not backend.is_supported(connection):
+		return SearchBackend()
+	return backend()
@@ -1,10 +1,17 @@
+from django.conf import settings
 from django.contrib.auth.models import Group
-from django.db.models.signals import post_save, pre_save
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 from guardian.shortcuts import assign_perm, get_perms_for_model
+from reversion.models import Version
+from reversion.signals import post_revision_commit
 
-from _1327.documents.models import Document
-from _1327.main.utils import slugify
+from _1327.documents.diff import create_revision_diffs
+from _1327.documents.models import Document, DocumentRevisionInfo, VersionTextDelta
+from _1327.documents.search import get_search_backend
+from _1327.documents.version_storage import compress_revision_texts, restore_version_texts
+from _1327.main.utils import bump_markdown_cache_generation, bump_menu_cache_generation, slugify
 
 
 @receiver(pre_save)
@@ -41,3 +48,104 @@ def permission_callback(sender, instance, created, *args, **kwargs):
 		for permission in group.permissions.all():
 			if permission in permissions:
 				assign_perm(permission.codename, group, instance)
+
+
+@receiver(post_save)
+def invalidate_rendered_links_on_save(sender, instance, created, *args, **kwargs):
+	"""
+		internal links are rendered to the url of the linked document, so cached renderings
+		are outdated as soon as a document appears or its url changes
+	"""
+	if sender not in Document.__subclasses__():
+		return
+
+	if created or instance.url_title != getattr(instance, '_loaded_url_title', None):
+		bump_markdown_cache_generation()
+		# menu items link to documents by their url as well
+		bump_menu_cache_generation()
+		instance._loaded_url_title = instance.url_title
+
+
+@receiver(post_delete)
+def invalidate_rendered_links_on_delete(sender, instance, *args, **kwargs):
+	if sender not in Document.__subclasses__():
+		return
+
+	bump_markdown_cache_generation()
+
+
+@receiver(post_save)
+def update_document_links(sender, instance, *args, **kwargs):
+	"""
+		keeps the index of links between documents up to date
+	"""
+	if sender not in Document.__subclasses__():
+		return
+
+	instance.update_links()
+
+
+@receiver(post_save)
+def update_search_index(sender, instance, *args, **kwargs):
+	if sender not in Document.__subclasses__():
+		return
+
+	get_search_backend().index_documents([instance])
+
+
+@receiver(post_delete)
+def remove_from_search_index(sender, instance, *args, **kwargs):
+	if sender not in Document.__subclasses__():
+		return
+
+	get_search_backend().delete_document(instance.pk)
+
+
+@receiver(post_revision_commit)
+def update_revision_info(sender, revision, versions, **kwargs):
+	"""
+		stores date, author and number of revisions for every document that is part of a new revision
+	"""
+	document_ids = {int(version.object_id) for version in versions if issubclass(version._model, Document)}
+	if not document_ids:
+		return
+
+	existing_ids = set(DocumentRevisionInfo.objects.filter(document_id__in=document_ids).values_list('document_id', flat=True))
+	DocumentRevisionInfo.objects.filter(document_id__in=existing_ids).update(
+		last_change=revision.date_created,
+		last_author=revision.user,
+		revision_count=F('revision_count') + 1,
+	)
+	DocumentRevisionInfo.objects.bulk_create([
+		DocumentRevisionInfo(document_id=document_id, last_change=revision.date_created, last_author=revision.user, revision_count=1)
+		for document_id in document_ids - existing_ids
+	])
+
+
+@receiver(post_revision_commit)
+def store_version_diffs(sender, revision, versions, **kwargs):
+	"""
+		stores the changes of the texts of every document that is part of a new revision,
+		so that the version history does not have to compare the full texts
+	"""
+	create_revision_diffs(versions)
+
+
+@receiver(post_revision_commit)
+def store_compressed_version_texts(sender, revision, versions, **kwargs):
+	"""
+		stores the texts of new document versions as changes to the previous versions, if enabled
+	"""
+	if not settings.COMPRESS_REVISION_TEXTS:
+		return
+
+	compress_revision_texts(versions)
+
+
+@receiver(pre_delete, sender=Version)
+def restore_texts_of_dependent_versions(sender, instance, **kwargs):
+	"""
+		versions whose texts are stored as changes to the deleted version get their full texts back
+	"""
+	for delta in VersionTextDelta.objects.filter(base_version=instance).select_related('version'):
+		restore_version_texts(delta.version)
@@ -2,13 +2,20 @@ from datetime import datetime
 import json
 import re
 import tempfile
+from unittest import skipUnless
+from unittest.mock import patch
 
+from asgiref.sync import async_to_sync
+import channels.layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
 from django.conf import settings
-from django.contrib.auth.models import Group
+from django.contrib.auth.models import AnonymousUser, Group
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.files.base import ContentFile
-from django.db import transaction
-from django.test import TestCase
+from django.db import connection, transaction
+from django.test import override_settings, TestCase, TransactionTestCase
 from django.urls import reverse
 from django_webtest import WebTest
 from guardian.shortcuts import assign_perm, get_perms, get_perms_for_model, remove_perm
@@ -16,17 +23,21 @@ from guardian.utils import get_anonymous_user
 import markdown
 from model_bakery import baker
 from reversion import revisions
-from reversion.models import Version
+from reversion.models import Revision, Version
 
 from _1327.documents.markdown_internal_link_extension import InternalLinksMarkdownExtension
 from _1327.documents.markdown_scaled_image_extension import SCALED_IMAGE_LINK_RE, ScaledImagePattern
 from _1327.information_pages.models import InformationDocument
-from _1327.main.utils import EscapeHtml, slugify
+from _1327.main.utils import EscapeHtml, render_markdown, slugify
 from _1327.minutes.models import MinutesDocument
 from _1327.polls.models import Poll
+from _1327.routing import websocket_urlpatterns
 from _1327.user_management.models import UserProfile
 
-from .models import Attachment, Document, TemporaryDocumentText
+from .models import Attachment, Document, TemporaryDocumentText, VersionDiff, VersionTextDelta
+from .preview import get_block_changes, get_preview_key, get_preview_request_key, get_preview_state, register_preview_request, split_blocks, update_preview
+from .search import get_search_backend, SearchBackend, TEXT_FIELDS, TITLE_FIELDS
+from .version_storage import get_version_texts
 
 
 class TestInternalLinkMarkDown(TestCase):
@@ -58,6 +69,18 @@ class TestInternalLinkMarkDown(TestCase):
 		text = self.md.convert('[description](document:{})'.format(document.id))
 		self.assertIn('<a>[missing link]</a>', text)
 
+	def test_links_are_resolved_in_bulk(self):
+		documents = baker.make(InformationDocument, _quantity=10)
+		text = '\n'.join('[link](document:{})'.format(document.id) for document in documents)
+		text += '\n[missing](document:{})'.format(max(document.id for document in documents) + 1)
+
+		# one query for the documents and one for the subclass they belong to
+		with self.assertNumQueries(2):
+			html = self.md.convert(text)
+		for document in documents:
+			self.assertIn(reverse(document.get_view_url_name(), args=[document.url_title]), html)
+		self.assertIn('<a>[missing link]</a>', html)
+
 
 class TestRevertion(WebTest):
 	csrf_checks = False
@@ -133,6 +156,7 @@ class TestRevertion(WebTest):
 		versions = Version.objects.get_for_object(self.document)
 		self.assertEqual(len(versions), 3)
 		self.assertEqual(versions[0].object.text_en, "text")
+		self.assertEqual(Document.objects.get().revision_count, 3)
 		self.assertEqual(versions[0].revision.get_comment(), 'reverted to revision "test version" (at {date})'.format(
 			date=datetime.utcnow().strftime("%Y-%m-%d %H:%M"),
 		))
@@ -158,6 +182,133 @@ class TestRevertion(WebTest):
 		self.assertEqual(response.status_code, 200)
 		self.assertIn(reverse('versions', args=[old_url]), response.body.decode('utf-8'))
 
+	def test_revert_restores_many_to_many_fields(self):
+		participants = baker.make(UserProfile, _quantity=3)
+		minutes = baker.prepare(MinutesDocument, author=self.user, date=datetime.now().date())
+		for version_participants in [participants[:2], participants[1:]]:
+			with transaction.atomic(), revisions.create_revision():
+				minutes.save()
+				minutes.participants.set(version_participants)
+				revisions.set_user(self.user)
+
+		first_version = Version.objects.get_for_object(minutes).last()
+		self.app.post(reverse('documents:revert'), params={'id': first_version.pk, 'url_title': minutes.url_title}, user=self.user, xhr=True)
+		self.assertEqual(set(MinutesDocument.objects.get(pk=minutes.pk).participants.all()), set(participants[:2]))
+
+		# versions of other documents can't be restored
+		other_version = Version.objects.get_for_object(self.document).first()
+		self.app.post(reverse('documents:revert'), params={'id': other_version.pk, 'url_title': minutes.url_title}, user=self.user, xhr=True, status=400)
+
+	def test_versions_are_paginated(self):
+		document = baker.prepare(InformationDocument)
+		for i in range(settings.VERSIONS_PER_PAGE + 1):
+			document.text_en = 'text {}'.format(i)
+			with transaction.atomic(), revisions.create_revision():
+				document.save()
+				revisions.set_user(self.user)
+				revisions.set_comment('version {}'.format(i))
+		versions = Version.objects.get_for_object(document).order_by('pk')
+
+		# the latest versions are shown first, without their texts
+		response = self.app.get(reverse('versions', args=[document.url_title]), user=self.user)
+		self.assertEqual(len(response.html.select('input[name="compare-a"]')), settings.VERSIONS_PER_PAGE)
+		self.assertIn('version {}'.format(settings.VERSIONS_PER_PAGE), response.text)
+		self.assertNotIn('version 0,', response.text)
+		self.assertNotIn('text 1', response.text)
+		self.assertIn('?page=2', response.text)
+
+		response = self.app.get(reverse('versions', args=[document.url_title]) + '?page=2', user=self.user)
+		self.assertEqual(len(response.html.select('input[name="compare-a"]')), 1)
+		self.assertIn('value="{}"'.format(versions[0].pk), response.text)
+		self.assertIn('?page=1', response.text)
+
+	def test_version_texts(self):
+		version = Version.objects.get_for_object(self.document).last()
+		url = reverse('documents:version_texts', args=[self.document.url_title, version.pk])
+
+		response = self.app.get(url, user=self.user)
+		self.assertEqual(response.json, {'text_de': '', 'text_en': 'text'})
+
+		self.app.get(url, user=baker.make(UserProfile), status=403)
+
+		# versions of other documents can't be loaded through this document
+		other_document = baker.make(Document)
+		self.app.get(reverse('documents:version_texts', args=[other_document.url_title, version.pk]), user=self.user, status=404)
+
+	def test_version_diffs(self):
+		versions = list(Version.objects.get_for_object(self.document))
+		self.assertEqual(versions[0].diff.previous_version, versions[1])
+		self.assertIsNone(versions[1].diff.previous_version)
+
+		url = reverse('documents:version_diff', args=[self.document.url_title, versions[0].pk])
+		response = self.app.get(url, user=self.user)
+		self.assertEqual(response.json, {
+			'previous_version': versions[1].pk,
+			'changes': {'text_de': [], 'text_en': [[1, [], 1, ['more text']]]},
+		})
+		self.app.get(url, user=baker.make(UserProfile), status=403)
+
+		# versions without stored changes get them when they are requested
+		VersionDiff.objects.all().delete()
+		response = self.app.get(url, user=self.user)
+		self.assertEqual(response.json['changes']['text_en'], [[1, [], 1, ['more text']]])
+		self.assertTrue(VersionDiff.objects.filter(version=versions[0]).exists())
+
+		self.app.post(reverse('documents:revert'), params={'id': versions[1].pk, 'url_title': self.document.url_title}, user=self.user, xhr=True)
+		diff = Version.objects.get_for_object(self.document).first().diff
+		self.assertEqual(diff.previous_version, versions[0])
+		self.assertEqual(json.loads(diff.changes)['text_en'], [[1, ['more text'], 1, []]])
+
+	@override_settings(COMPRESS_REVISION_TEXTS=True)
+	def test_compressed_versions(self):
+		document = baker.prepare(InformationDocument)
+		texts = ['first line\nsecond line', 'first line\nchanged line\n', 'first line']
+		for text in texts:
+			document.text_en = text
+			with transaction.atomic(), revisions.create_revision():
+				document.save()
+				revisions.set_user(self.user)
+
+		text_versions = Version.objects.get_for_object_reference(Document, document.pk).order_by('pk')
+		self.assertEqual(VersionTextDelta.objects.filter(version__in=text_versions).count(), 2)
+		self.assertNotIn('changed line', text_versions[1].serialized_data)
+
+		versions = list(Version.objects.get_for_object(document).order_by('pk'))
+		for version, text in zip(versions, texts):
+			response = self.app.get(reverse('documents:version_texts', args=[document.url_title, version.pk]), user=self.user)
+			self.assertEqual(response.json['text_en'], text)
+		response = self.app.get(reverse('documents:version_diff', args=[document.url_title, versions[2].pk]), user=self.user)
+		self.assertEqual(response.json['changes']['text_en'], [[1, ['changed line'], 1, []]])
+
+		self.app.post(reverse('documents:revert'), params={'id': versions[1].pk, 'url_title': document.url_title}, user=self.user, xhr=True)
+		self.assertEqual(InformationDocument.objects.get().text_en, texts[1])
+		self.assertEqual(get_version_texts(Version.objects.get_for_object(document).first())['text_en'], texts[1])
+
+	@override_settings(COMPRESS_REVISION_TEXTS=True)
+	def test_delete_compressed_versions(self):
+		document = baker.prepare(InformationDocument)
+		texts = ['first line', 'first line\nsecond line', 'second line', 'third line']
+		for text in texts:
+			document.text_en = text
+			with transaction.atomic(), revisions.create_revision():
+				document.save()
+
+		# versions whose texts are stored as changes to a deleted version get their full texts back
+		versions = list(Version.objects.get_for_object(document).order_by('pk'))
+		versions[0].revision.delete()
+		text_versions = Version.objects.get_for_object_reference(Document, document.pk).order_by('pk')
+		self.assertIn('first line\\nsecond line', text_versions[0].serialized_data)
+		self.assertEqual(VersionTextDelta.objects.filter(version__in=text_versions).count(), 2)
+		for version, text in zip(versions[1:], texts[1:]):
+			self.assertEqual(get_version_texts(version)['text_en'], text)
+
+		versions[2].revision.delete()
+		self.assertEqual(get_version_texts(versions[1])['text_en'], texts[1])
+		self.assertEqual(get_version_texts(versions[3])['text_en'], texts[3])
+
+		Revision.objects.all().delete()
+		self.assertFalse(VersionTextDelta.objects.exists())
+
 	def test_version_creation(self):
 		Document.objects.all().delete()
 		self.assertEqual(Document.objects.count(), 0)
@@ -202,6 +353,11 @@ class TestRevertion(WebTest):
 			for version, text in zip(versions, [text_1, text_2]):
 				self.assertEqual(version.field_dict['text_en'], text)
 
+			document = Document.objects.get(url_title=url_title)
+			self.assertEqual(document.revision_count, 2)
+			self.assertEqual(document.last_author, self.user)
+			self.assertEqual(document.last_change, versions.last().revision.date_created)
+
 
 class TestAutosave(WebTest):
 	csrf_checks = False
@@ -276,6 +432,42 @@ class TestAutosave(WebTest):
 		self.assertEqual(form.get('text_de').value, 'AUTO2_de')
 		self.assertEqual(form.get('text_en').value, 'AUTO2_en')
 
+	def post_autosave_changes(self, revision, changes, status=200):
+		return self.app.post(
+			reverse('documents:autosave_changes', args=[self.document.url_title]),
+			params=json.dumps({'revision': revision, 'changes': changes}),
+			content_type='application/json',
+			user=self.user,
+			xhr=True,
+			status=status,
+		)
+
+	def test_autosave_changes(self):
+		response = self.app.post(
+			reverse('documents:autosave', args=[self.document.url_title]),
+			params={'text_de': 'AUTO_de\r\nline', 'text_en': 'AUTO_en', 'title_en': self.document.title_en, 'comment': ''},
+			user=self.user,
+			xhr=True
+		)
+		self.assertEqual(json.loads(response.body)['revision'], 1)
+		self.assertEqual(TemporaryDocumentText.objects.get().text_de, 'AUTO_de\nline')
+
+		# unchanged texts are not written again
+		response = self.post_autosave_changes(1, {'text_en': [0, 0, '']})
+		self.assertEqual(json.loads(response.body)['revision'], 1)
+
+		response = self.post_autosave_changes(1, {'text_de': [4, 4, '_🎉'], 'text_en': [5, 7, 'EN']})
+		self.assertEqual(json.loads(response.body)['revision'], 2)
+		autosave = TemporaryDocumentText.objects.get()
+		self.assertEqual(autosave.text_de, 'AUTO_🎉_de\nline')
+		self.assertEqual(autosave.text_en, 'AUTO_EN')
+
+		# changes to an outdated revision are rejected
+		self.post_autosave_changes(1, {'text_de': [0, 0, 'outdated']}, status=409)
+		self.post_autosave_changes(2, {'text_de': [0, 100, '']}, status=400)
+		self.post_autosave_changes(2, {'title_de': [0, 0, '']}, status=400)
+		self.assertEqual(TemporaryDocumentText.objects.get().revision, 2)
+
 	def test_autosave_not_logged_in(self):
 		response = self.app.get(reverse('documents:create', args=['informationdocument']), user=self.user)
 		self.assertEqual(response.status_code, 200)
@@ -720,6 +912,10 @@ class TestMarkdownRendering(WebTest):
 		cls.document = baker.make(InformationDocument, text_en=cls.document_text)
 		cls.document.set_all_permissions(baker.make(Group))
 
+	def setUp(self):
+		for language in ['', 'de', 'en']:
+			cache.delete_many([get_preview_key(self.document.hash_value, language), get_preview_request_key(self.document.hash_value, language)])
+
 	def test_render_text_no_permission(self):
 		user_without_permission = baker.make(UserProfile)
 		response = self.app.post(
@@ -751,6 +947,110 @@ class TestMarkdownRendering(WebTest):
 		self.assertEqual(response.status_code, 200)
 		self.assertEqual('<p>' + self.document_text + '</p>', response.body.decode('utf-8'))
 
+	def render_text(self, text, language='en'):
+		return self.app.post(
+			reverse('documents:render', args=[self.document.url_title]),
+			params={'text': text, 'language': language},
+			user=self.user,
+			xhr=True
+		)
+
+	def test_render_text_sends_changed_blocks(self):
+		channel_layer = channels.layers.get_channel_layer()
+		channel_name = async_to_sync(channel_layer.new_channel)()
+		async_to_sync(channel_layer.group_add)(self.document.hash_value, channel_name)
+
+		# watchers get all blocks of a new preview
+		self.render_text('# Title\n\nfirst\n\nsecond')
+		preview = json.loads(async_to_sync(channel_layer.receive)(channel_name)['message'])
+		self.assertEqual(preview['language'], 'en')
+		self.assertEqual(preview['blocks'], ['<h2 id="title">Title</h2>', '<p>first</p>', '<p>second</p>'])
+
+		# afterwards only the changed blocks are sent
+		response = self.render_text('# Title\n\nchanged\n\nsecond')
+		self.assertEqual(response.body.decode('utf-8'), '<h2 id="title">Title</h2>\n<p>changed</p>\n<p>second</p>')
+		changes = json.loads(async_to_sync(channel_layer.receive)(channel_name)['message'])
+		self.assertEqual(changes['base_version'], preview['version'])
+		self.assertEqual(changes['changes'], [[1, 2, ['<p>changed</p>']]])
+
+		async_to_sync(channel_layer.group_discard)(self.document.hash_value, channel_name)
+
+	def test_render_text_drops_superseded_requests(self):
+		def render_markdown_during_next_request(text):
+			register_preview_request(self.document.hash_value, 'de')
+			return render_markdown(text)
+
+		with patch('_1327.documents.views.render_markdown', render_markdown_during_next_request):
+			response = self.render_text('superseded', language='de')
+		self.assertEqual(response.status_code, 204)
+
+		response = self.render_text('current', language='de')
+		self.assertEqual(response.body.decode('utf-8'), '<p>current</p>')
+
+
+class TestPreviewBlocks(TestCase):
+
+	def test_split_blocks(self):
+		html = '<h1 id="a">A</h1>\n<p>b<br>\n<img src="c" alt="d>e"></p>\n<hr>\n<ul>\n<li>f</li>\n</ul>'
+		self.assertEqual(split_blocks(html), ['<h1 id="a">A</h1>', '<p>b<br>\n<img src="c" alt="d>e"></p>', '<hr>', '<ul>\n<li>f</li>\n</ul>'])
+
+	def test_block_changes(self):
+		old_blocks = ['<p>a</p>', '<p>b</p>', '<p>c</p>']
+		self.assertEqual(get_block_changes(old_blocks, old_blocks), [])
+		self.assertEqual(get_block_changes(old_blocks, ['<p>a</p>', '<p>c</p>', '<p>d</p>']), [[1, 2, []], [3, 3, ['<p>d</p>']]])
+
+	def test_concurrent_updates_get_different_versions(self):
+		update_preview('concurrent', 'en', 'first', '<p>first</p>')
+		state = get_preview_state('concurrent', 'en')
+
+		# both renderings read the same preview before either of them is stored
+		with patch('_1327.documents.preview.get_preview_state', return_value=state):
+			messages = [json.loads(update_preview('concurrent', 'en', text, '<p>{}</p>'.format(text))) for text in ['a', 'b']]
+		self.assertEqual([message['base_version'] for message in messages], [state['version']] * 2)
+		self.assertNotEqual(messages[0]['version'], messages[1]['version'])
+
+
+class TestPreviewConsumer(TransactionTestCase):
+
+	def setUp(self):
+		self.user = baker.make(UserProfile, is_superuser=True)
+		self.document = baker.make(InformationDocument)
+		self.document.set_all_permissions(baker.make(Group))
+
+	async def connect(self, user):
+		communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '{}/{}'.format(settings.PREVIEW_URL, self.document.hash_value))
+		communicator.scope['user'] = user
+		connected, __ = await communicator.connect()
+		self.assertTrue(connected)
+		return communicator
+
+	def test_render_preview(self):
+		async def render_preview():
+			editor = await self.connect(self.user)
+			watcher = await self.connect(AnonymousUser())
+
+			await editor.send_json_to({'language': 'en', 'text': 'preview'})
+			self.assertEqual(await editor.receive_json_from(), {'language': 'en', 'rendered_text': '<p>preview</p>'})
+			self.assertEqual((await watcher.receive_json_from())['blocks'], ['<p>preview</p>'])
+
+			# watchers that join later get the current preview
+			late_watcher = await self.connect(AnonymousUser())
+			await late_watcher.send_json_to({'language': 'en'})
+			self.assertEqual((await late_watcher.receive_json_from())['blocks'], ['<p>preview</p>'])
+
+			for communicator in [editor, watcher, late_watcher]:
+				await communicator.disconnect()
+
+		async_to_sync(render_preview)()
+
+	def test_render_preview_without_permission(self):
+		async def render_preview():
+			communicator = await self.connect(AnonymousUser())
+			await communicator.send_json_to({'language': 'en', 'text': 'preview'})
+			self.assertEqual((await communicator.receive_output())['type'], 'websocket.close')
+
+		async_to_sync(render_preview)()
+
 
 class TestLanguage(WebTest):
 	csrf_checks = False
@@ -849,6 +1149,70 @@ class TestSignals(TestCase):
 		test_object.save()
 		self.assertFalse(test_user.has_perm(permission_names[0], test_object))
 
+	def test_document_link_hook(self):
+		target = baker.make(InformationDocument)
+		other_target = baker.make(MinutesDocument)
+		source = baker.make(
+			InformationDocument,
+			text_en="[link](document:{}) [missing](document:{})".format(target.id, 99999),
+			text_de="[Link](document:{})".format(other_target.id),
+		)
+		self.assertSetEqual(set(source.outgoing_links.values_list('target_id', flat=True)), {target.id, other_target.id})
+		self.assertEqual(target.incoming_links.get().source_id, source.id)
+
+		source.text_de = ""
+		source.save()
+		self.assertSetEqual(set(source.outgoing_links.values_list('target_id', flat=True)), {target.id})
+		self.assertFalse(other_target.incoming_links.exists())
+
+
+class TestSearch(TestCase):
+
+	def test_search_index_is_updated(self):
+		document = baker.make(InformationDocument, title_en="Meeting agenda", text_en="Nothing special")
+		search_backend = get_search_backend()
+
+		self.assertEqual(list(search_backend.filter(InformationDocument.objects.all(), "agend", TITLE_FIELDS)), [document])
+		self.assertEqual(list(search_backend.filter(InformationDocument.objects.all(), "agenda", TEXT_FIELDS)), [])
+
+		document.title_en = "Meeting notes"
+		document.save()
+		self.assertEqual(list(search_backend.filter(InformationDocument.objects.all(), "agenda", TITLE_FIELDS)), [])
+		self.assertEqual(list(search_backend.filter(InformationDocument.objects.all(), "NOTES", TITLE_FIELDS)), [document])
+
+		document.delete()
+		self.assertEqual(list(search_backend.filter(InformationDocument.objects.all(), "notes", TITLE_FIELDS)), [])
+
+	def test_search_results_are_ranked(self):
+		# the rare match only contains a longer word, so it ranks lower on all databases
+		rare_match = baker.make(InformationDocument, text_en="a budgeting " + "filler " * 100)
+		frequent_match = baker.make(InformationDocument, text_en="budget budget budget")
+		baker.make(InformationDocument, text_en="no match")
+
+		results = get_search_backend().filter(InformationDocument.objects.all(), "budget", TEXT_FIELDS).order_by('search_rank')
+		self.assertEqual(list(results), [frequent_match, rare_match])
+
+	@skipUnless(connection.vendor == 'sqlite', "the index is only missing on SQLite")
+	def test_search_without_index(self):
+		# the migrations don't create the index if SQLite doesn't support the trigram tokenizer
+		with connection.cursor() as cursor:
+			cursor.execute('DROP TABLE documents_search_index')
+		connection._search_index_exists = False
+		document = baker.make(InformationDocument, title_en="Meeting agenda")
+
+		search_backend = get_search_backend()
+		self.assertEqual(type(search_backend), SearchBackend)
+		self.assertEqual(list(search_backend.filter(InformationDocument.objects.all(), "agenda", TITLE_FIELDS)), [document])
+
+	def test_search_api(self):
+		document = baker.make(InformationDocument, title_de="Haushalt", title_en="Budget")
+		assign_perm(document.view_permission_name, get_anonymous_user(), document)
+		baker.make(InformationDocument, title_de="Haushalt", title_en="Budget")
+
+		response = self.client.get(reverse('documents:search'), {'q': 'udge', 'id_only': 'True'})
+		self.assertEqual(json.loads(response.content)['results'][0]['children'][0]['id'], document.id)
+		self.assertEqual(len(json.loads(response.content)['results'][0]['children']), 1)
+
 
 class TestSubclassConstraints(TestCase):
 	def is_abstract_model(self, cls):
@@ -1,3 +1,5 @@
+from collections import Counter
+from datetime import datetime
 from functools import lru_cache
 import json
 import re
@@ -5,13 +7,18 @@ import re
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import SuspiciousOperation
+from django.core.paginator import Paginator
 from django.db import transaction
+from django.db.models import CharField, Exists, OuterRef
+from django.db.models.functions import Cast
 from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
 from reversion import revisions
 from reversion.models import Version
 
 from _1327.documents.forms import AttachmentForm
 from _1327.documents.models import Document, TemporaryDocumentText
+from _1327.documents.version_storage import get_version_fields
 
 
 def get_new_autosaved_pages_for_user(user, content_type):
@@ -27,12 +34,39 @@ def get_new_autosaved_pages_for_user(user, content_type):
 	return autosaved_pages
 
 
-def delete_old_empty_pages():
-	all_documents = Document.objects.filter(created__lte=timezone.now() - settings.DELETE_EMPTY_PAGE_AFTER)
-	for document in all_documents:
-		if len(Version.objects.get_for_object(document)) == 0 and \
-			not TemporaryDocumentText.objects.filter(document=document).exists():
-				document.delete()
+def get_old_empty_pages():
+	"""
+		returns the documents that were created more than DELETE_EMPTY_PAGE_AFTER ago,
+		but were never saved and have no autosaves
+	"""
+	content_types = ContentType.objects.get_for_models(Document, *Document.__subclasses__()).values()
+	versions = Version.objects.filter(content_type__in=content_types, object_id=Cast(OuterRef('pk'), CharField()))
+	autosaves = TemporaryDocumentText.objects.filter(document=OuterRef('pk'))
+	return Document.objects.non_polymorphic().filter(
+		~Exists(versions),
+		~Exists(autosaves),
+		created__lte=timezone.now() - settings.DELETE_EMPTY_PAGE_AFTER,
+	)
+
+
+def delete_old_empty_pages(batch_size):
+	"""
+		deletes the old empty pages in batches of the given size,
+		returns the number of deleted objects per model and the number of batches
+	"""
+	empty_pages = get_old_empty_pages()
+	deleted_objects = Counter()
+	batches = 0
+	while True:
+		with transaction.atomic():
+			page_ids = list(empty_pages.order_by('pk').values_list('pk', flat=True)[:batch_size])
+			if not page_ids:
+				break
+			# the conditions are checked again, in case a page was saved in the meantime
+			__, deleted_batch_objects = empty_pages.filter(pk__in=page_ids).delete()
+		deleted_objects.update(deleted_batch_objects)
+		batches += 1
+	return deleted_objects, batches
 
 
 def handle_edit(request, document, formset=None, initial=None, creation_group=None):
@@ -124,33 +158,76 @@ def handle_edit(request, document, formset=None, initial=None, creation_group=No
 
 
 def handle_autosave(request, document):
-	if request.method == 'POST':
-		form = document.Form(request.POST, user=request.user, creation=document.is_in_creation, instance=document)
-		form.is_valid()
-		text_de_strip = request.POST.get('text_de', default='').strip()
-		text_en_strip = request.POST.get('text_en', default='').strip()
-		if text_de_strip != '' or text_en_strip != '':
-			cleaned_data = form.cleaned_data
-
-			if document is None:
-				temporary_document_text = TemporaryDocumentText.objects.create(author=request.user)
-			else:
-				temporary_document_text, __ = TemporaryDocumentText.objects.get_or_create(document=document, author=request.user)
-
-			temporary_document_text.text_de = cleaned_data['text_de']
-			temporary_document_text.text_en = cleaned_data['text_en']
-			temporary_document_text.save()
-
-
-def prepare_versions(document):
-	versions = Version.objects.get_for_object(document).reverse()
-
-	# prepare data for the template
-	version_list = []
-	for id, version in enumerate(versions):
-		version_list.append((id, version, json.dumps(version.field_dict['text_de']).strip('"'), json.dumps(version.field_dict['text_en']).strip('"')))
-
-	return version_list
+	"""
+		stores the texts of the request as autosave of the user, returns the revision of the autosave
+	"""
+	# forms are submitted with \r\n line breaks, the changes sent by the editor refer to texts with \n line breaks
+	texts = {field: request.POST.get(field, default='').replace('\r\n', '\n') for field in TemporaryDocumentText.AUTOSAVED_FIELDS}
+	if all(text.strip() == '' for text in texts.values()):
+		return None
+
+	temporary_document_text, __ = TemporaryDocumentText.objects.get_or_create(document=document, author=request.user)
+	return save_autosaved_texts(temporary_document_text, temporary_document_text.revision, texts)
+
+
+def handle_autosave_changes(request, document):
+	"""
+		applies the changes of the request to the autosave of the user. every change replaces the text between
+		start and end of a field with a new text. changes refer to a revision of the autosave, the revision of the
+		changed autosave is returned, None if the autosave was changed meanwhile.
+	"""
+	try:
+		data = json.loads(request.body)
+		revision = int(data['revision'])
+		changes = {field: (int(start), int(end), str(new_text)) for field, (start, end, new_text) in data['changes'].items()}
+	except (ValueError, KeyError, TypeError, AttributeError):
+		raise SuspiciousOperation
+	if not set(changes).issubset(TemporaryDocumentText.AUTOSAVED_FIELDS):
+		raise SuspiciousOperation
+
+	temporary_document_text = TemporaryDocumentText.objects.filter(document=document, author=request.user).first()
+	if temporary_document_text is None or temporary_document_text.revision != revision:
+		return None
+
+	texts = {}
+	for field, (start, end, new_text) in changes.items():
+		text = getattr(temporary_document_text, field)
+		if not 0 <= start <= end <= len(text):
+			raise SuspiciousOperation
+		texts[field] = text[:start] + new_text + text[end:]
+	return save_autosaved_texts(temporary_document_text, revision, texts)
+
+
+def save_autosaved_texts(temporary_document_text, revision, texts):
+	"""
+		writes the texts that changed, returns the new revision or None if the autosave is not at the given revision anymore
+	"""
+	changed_texts = {field: text for field, text in texts.items() if text != getattr(temporary_document_text, field)}
+	if not changed_texts:
+		return revision
+
+	# the revision is compared in the update, so that concurrent changes can't overwrite each other
+	num_updated = TemporaryDocumentText.objects.filter(id=temporary_document_text.id, revision=revision).update(
+		revision=revision + 1,
+		created=timezone.now(),
+		**changed_texts
+	)
+	if num_updated == 0:
+		return None
+	return revision + 1
+
+
+def prepare_versions(document, page_number=None):
+	"""
+		returns the requested page of versions of the document (the latest versions by default)
+		and the versions of the page together with their number, oldest first.
+		only the metadata of the versions is loaded, their texts are requested when they are compared.
+	"""
+	versions = Version.objects.get_for_object(document).select_related('revision__user').defer('serialized_data')
+	paginator = Paginator(versions, settings.VERSIONS_PER_PAGE)
+	page = paginator.get_page(page_number)
+	version_list = [(paginator.count - page.start_index() - index, version) for index, version in enumerate(page)]
+	return page, version_list[::-1]
 
 
 def handle_attachment(request, document):
@@ -169,6 +246,54 @@ def handle_attachment(request, document):
 	return False, form, None
 
 
+@lru_cache(maxsize=32)
+def get_restored_fields(document_class):
+	"""
+		returns the names of the fields of the document class that are restored from versions,
+		separately for plain and many-to-many fields. parent links are not restored.
+	"""
+	fields = frozenset(
+		field.attname for field in document_class._meta.concrete_fields
+		if field.remote_field is None or not field.remote_field.parent_link
+	)
+	many_to_many_fields = frozenset(field.attname for field in document_class._meta.many_to_many)
+	return fields, many_to_many_fields
+
+
+def revert_document(document, version_id, user):
+	"""
+		restores the document to its version with the given id in a new revision and returns the restored document
+	"""
+	revert_version = Version.objects.get_for_object(document).select_related('revision').filter(pk=version_id).first()
+	if revert_version is None:
+		# user supplied version_id that does not exist
+		raise SuspiciousOperation('Could not find document')
+
+	version_fields = get_version_fields(revert_version)
+	document_class = ContentType.objects.get_for_id(version_fields['polymorphic_ctype_id']).model_class()
+	fields, many_to_many_fields = get_restored_fields(document_class)
+	reverted_document = document_class(**{key: value for key, value in version_fields.items() if key in fields})
+
+	with transaction.atomic():
+		# the versions of the document are restored by saving the reverted document, other objects of the revision as they are
+		for version in revert_version.revision.version_set.all():
+			if version.object_id != revert_version.object_id or not issubclass(version._model, Document):
+				version.revert()
+
+		with revisions.create_revision():
+			reverted_document.save()
+			for key in many_to_many_fields & version_fields.keys():
+				getattr(reverted_document, key).set(version_fields[key])
+			revisions.set_user(user)
+			revisions.set_comment(
+				_('reverted to revision \"{revision_comment}\" (at {date})'.format(
+					revision_comment=revert_version.revision.get_comment(),
+					date=datetime.utcnow().strftime("%Y-%m-%d %H:%M"),
+				))
+			)
+	return reverted_document
+
+
 @lru_cache(maxsize=32)
 def get_model_function(content_type, function_name):
 	module = __import__('_1327.{content_type}.views'.format(content_type=content_type.app_label), fromlist=[function_name])
@@ -0,0 +1,169 @@
+from difflib import SequenceMatcher
+import json
+import zlib
+
+from django.conf import settings
+from reversion.models import Version
+
+from _1327.documents.models import Document, VersionTextDelta
+from _1327.documents.search import TEXT_FIELDS
+
+
+def get_text_changes(old_text, new_text):
+	"""
+		returns the changes that turn the old text into the new one
+		as a list of [start, end, replacement], referring to the lines of the old text
+	"""
+	old_lines = old_text.splitlines(keepends=True)
+	new_lines = new_text.splitlines(keepends=True)
+	matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+	return [
+		[old_start, old_end, ''.join(new_lines[new_start:new_end])]
+		for operation, old_start, old_end, new_start, new_end in matcher.get_opcodes()
+		if operation != 'equal'
+	]
+
+
+def apply_text_changes(text, changes):
+	lines = text.splitlines(keepends=True)
+	# later changes are applied first, so that the line numbers of the earlier ones stay valid
+	for start, end, replacement in reversed(changes):
+		lines[start:end] = [replacement]
+	return ''.join(lines)
+
+
+def get_text_delta(version):
+	try:
+		return version.text_delta
+	except VersionTextDelta.DoesNotExist:
+		return None
+
+
+def get_text_version(version):
+	"""
+		returns the version of the document model in the revision of the version, which contains the texts
+	"""
+	if version._model is Document:
+		return version
+	return Version.objects.get_for_object_reference(Document, version.object_id).filter(revision_id=version.revision_id).first()
+
+
+def get_stored_texts(text_version):
+	return {field: text_version.field_dict.get(field) or '' for field in TEXT_FIELDS}
+
+
+def apply_delta(texts, delta):
+	changes = json.loads(zlib.decompress(delta.changes).decode())
+	return {field: apply_text_changes(texts[field], changes[field]) for field in TEXT_FIELDS}
+
+
+def get_version_texts(version):
+	"""
+		returns the texts of the document version, reconstructed from the last version with full texts if necessary
+	"""
+	text_version = get_text_version(version)
+	delta = get_text_delta(text_version)
+	if delta is None:
+		return get_stored_texts(text_version)
+
+	# the chain consists of the versions right before this one, so all of its deltas are fetched at once
+	deltas = [delta]
+	if delta.chain_length > 1:
+		chain = VersionTextDelta.objects.filter(
+			version__content_type_id=text_version.content_type_id,
+			version__object_id=text_version.object_id,
+			version_id__lt=text_version.pk,
+		).order_by('-version_id')[:delta.chain_length - 1]
+		deltas_by_version = {chain_delta.version_id: chain_delta for chain_delta in chain}
+		while delta.base_version_id in deltas_by_version:
+			delta = deltas_by_version[delta.base_version_id]
+			deltas.append(delta)
+
+	texts = get_version_texts(Version.objects.select_related('text_delta').get(pk=delta.base_version_id))
+	for delta in reversed(deltas):
+		texts = apply_delta(texts, delta)
+	return texts
+
+
+def get_version_fields(version):
+	"""
+		returns the field dict of the document version with its reconstructed texts
+	"""
+	fields = dict(version.field_dict)
+	fields.update(get_version_texts(version))
+	return fields
+
+
+def compress_version_texts(version, previous_version, previous_texts=None):
+	"""
+		stores the texts of the version of the document model as changes to the texts of the previous version,
+		unless the version is due to keep its full texts. returns whether the texts were compressed.
+	"""
+	if version.format != 'json' or get_text_delta(version) is not None:
+		return False
+	previous_delta = get_text_delta(previous_version)
+	chain_length = previous_delta.chain_length + 1 if previous_delta is not None else 1
+	if chain_length >= settings.REVISION_SNAPSHOT_INTERVAL:
+		return False
+
+	if previous_texts is None:
+		previous_texts = get_version_texts(previous_version)
+	texts = get_stored_texts(version)
+	changes = {field: get_text_changes(previous_texts[field], texts[field]) for field in TEXT_FIELDS}
+	VersionTextDelta.objects.create(
+		version=version,
+		base_version=previous_version,
+		chain_length=chain_length,
+		changes=zlib.compress(json.dumps(changes).encode()),
+	)
+
+	data = json.loads(version.serialized_data)
+	for field in TEXT_FIELDS:
+		data[0]['fields'][field] = ''
+	Version.objects.filter(pk=version.pk).update(serialized_data=json.dumps(data))
+	return True
+
+
+def restore_version_texts(version):
+	"""
+		stores the full texts in the serialized data of the compressed version again
+	"""
+	texts = get_version_texts(version)
+	data = json.loads(version.serialized_data)
+	data[0]['fields'].update(texts)
+	Version.objects.filter(pk=version.pk).update(serialized_data=json.dumps(data))
+	VersionTextDelta.objects.filter(version=version).delete()
+
+
+def compress_revision_texts(versions):
+	"""
+		compresses the texts of the documents that are part of a new revision
+	"""
+	for version in versions:
+		if version._model is not Document:
+			continue
+		previous_version = Version.objects.get_for_object_reference(Document, version.object_id).filter(pk__lt=version.pk).first()
+		if previous_version is not None:
+			compress_version_texts(version, previous_version)
+
+
+def compress_document_history(document_id):
+	"""
+		compresses the texts of all versions of the document that are not due to keep their full texts,
+		returns the number of compressed versions
+	"""
+	versions = Version.objects.get_for_object_reference(Document, document_id).select_related('text_delta').order_by('pk')
+	compressed_versions = 0
+	previous_version = None
+	previous_texts = None
+	for version in versions.iterator():
+		delta = get_text_delta(version)
+		if delta is not None:
+			texts = apply_delta(previous_texts, delta)
+		else:
+			texts = get_stored_texts(version)
+			if previous_version is not None and compress_version_texts(version, previous_version, previous_texts):
+				compressed_versions += 1
+		previous_version = version
+		previous_texts = texts
+	return compressed_versions
@@ -2,36 +2,35 @@ from datetime import datetime
 import json
 import os
 
-from asgiref.sync import async_to_sync
-import channels.layers
-
 from django.contrib import messages
 from django.contrib.admin.utils import NestedObjects
 from django.contrib.auth.models import Group
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied, SuspiciousOperation
-from django.db import DEFAULT_DB_ALIAS, models, transaction
-from django.db.models import Q
+from django.db import DEFAULT_DB_ALIAS
 from django.forms import formset_factory
-from django.http import HttpResponse, HttpResponseNotAllowed, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseNotAllowed, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, Http404, render
 from django.urls import reverse
-from django.utils.translation import gettext_lazy as _
+from django.utils.translation import get_language, gettext_lazy as _
 from guardian.shortcuts import get_objects_for_user
 from guardian.utils import get_anonymous_user
 
-from reversion import revisions
 from reversion.models import Version
 from sendfile import sendfile
 
 from _1327 import settings
+from _1327.documents.diff import get_version_diff
 from _1327.documents.forms import get_permission_form
 from _1327.documents.models import Attachment, Document, TemporaryDocumentText
-from _1327.documents.utils import delete_cascade_to_json, delete_old_empty_pages, get_model_function, get_new_autosaved_pages_for_user, \
-	handle_attachment, handle_autosave, handle_edit, prepare_versions
+from _1327.documents.preview import get_cached_preview, is_superseded, publish_preview, register_preview_request
+from _1327.documents.search import get_search_backend, TITLE_FIELDS
+from _1327.documents.utils import delete_cascade_to_json, get_model_function, get_new_autosaved_pages_for_user, \
+	handle_attachment, handle_autosave, handle_autosave_changes, handle_edit, prepare_versions, revert_document
+from _1327.documents.version_storage import get_version_texts
 from _1327.information_pages.models import InformationDocument
 from _1327.information_pages.forms import InformationDocumentForm  # noqa
-from _1327.main.utils import convert_markdown, document_permission_overview
+from _1327.main.utils import convert_markdown, document_permission_overview, render_markdown
 from _1327.minutes.models import MinutesDocument
 from _1327.minutes.forms import MinutesDocumentForm  # noqa
 from _1327.polls.models import Poll
@@ -43,7 +42,6 @@ def create(request, document_type):
 	content_type = ContentType.objects.get(model=document_type)
 	if request.user.has_perm("{app}.add_{model}".format(app=content_type.app_label, model=content_type.model)):
 		model_class = content_type.model_class()
-		delete_old_empty_pages()
 		title_en, title_de = model_class.generate_new_title()
 		url_title = "temp_{}_{}".format(datetime.utcnow().strftime("%d%m%Y%H%M%S%f"), model_class.generate_default_slug(title_en))
 		kwargs = {
@@ -104,36 +102,55 @@ def edit(request, title, new_autosaved_pages=None, initial=None):
 			'permission_overview': document_permission_overview(request.user, document),
 			'supported_image_types': settings.SUPPORTED_IMAGE_TYPES,
 			'formset': formset,
+			'preview_url': settings.PREVIEW_URL,
 		})
 
 
-def autosave(request, title):
+def get_autosaved_document(request, title):
+	if request.method != 'POST':
+		raise SuspiciousOperation
 	if request.user.is_anonymous or request.user == get_anonymous_user():
 		raise PermissionDenied()
 
-	document = None
-	try:
-		document = get_object_or_404(Document, url_title=title)
-		if document.has_perms():
-			check_permissions(document, request.user, [document.edit_permission_name])
-	except Document.DoesNotExist:
-		pass
+	document = get_object_or_404(Document, url_title=title)
+	if document.has_perms():
+		check_permissions(document, request.user, [document.edit_permission_name])
+	else:
+		# documents without permissions are in creation, which needs the permission to add documents
+		check_permissions(document, request.user, [document.add_permission_name])
+	return document
 
-	handle_autosave(request, document)
 
+def get_autosave_response(request, document, revision):
 	data = {
 		'preview_url': request.build_absolute_uri(
 			reverse('documents:preview') + '?hash_value=' + document.hash_value
-		)
+		),
+		'revision': revision,
 	}
 
 	return HttpResponse(json.dumps(data))
 
 
+def autosave(request, title):
+	document = get_autosaved_document(request, title)
+	revision = handle_autosave(request, document)
+	return get_autosave_response(request, document, revision)
+
+
+def autosave_changes(request, title):
+	document = get_autosaved_document(request, title)
+	revision = handle_autosave_changes(request, document)
+	if revision is None:
+		# the autosave changed meanwhile, the editor has to send the complete texts
+		return HttpResponse(status=409)
+	return get_autosave_response(request, document, revision)
+
+
 def versions(request, title):
 	document = get_object_or_404(Document, url_title=title)
 	check_permissions(document, request.user, [document.edit_permission_name])
-	document_versions = prepare_versions(document)
+	page, document_versions = prepare_versions(document, request.GET.get('page'))
 
 	if not document.can_be_reverted:
 		messages.warning(request, _('This Document can not be reverted!'))
@@ -141,12 +158,34 @@ def versions(request, title):
 	return render(request, 'documents_versions.html', {
 		'active_page': 'versions',
 		'versions': document_versions,
+		'page': page,
 		'document': document,
 		'permission_overview': document_permission_overview(request.user, document),
 		'can_be_reverted': document.can_be_reverted,
 	})
 
 
+def get_document_version(request, title, version_id):
+	document = get_object_or_404(Document, url_title=title)
+	check_permissions(document, request.user, [document.edit_permission_name])
+	return get_object_or_404(Version.objects.get_for_object(document), pk=version_id)
+
+
+def version_texts(request, title, version_id):
+	version = get_document_version(request, title, version_id)
+
+	return JsonResponse(get_version_texts(version))
+
+
+def version_diff(request, title, version_id):
+	diff = get_version_diff(get_document_version(request, title, version_id))
+
+	return JsonResponse({
+		'previous_version': diff.previous_version_id,
+		'changes': json.loads(diff.changes),
+	})
+
+
 def view(request, title):
 	document = get_object_or_404(Document, url_title=title)
 	content_type = ContentType.objects.get_for_model(document)
@@ -245,18 +284,25 @@ def render_text(request, title):
 	if document.has_perms():
 		check_permissions(document, request.user, [document.view_permission_name, document.edit_permission_name])
 
-	text, __ = convert_markdown(request.POST['text'])
+	hash_value = document.hash_value
+	language = request.POST.get('language', '')
+	text = request.POST['text']
+	request_number = register_preview_request(hash_value, language)
 
-	channel_layer = channels.layers.get_channel_layer()
-	async_to_sync(channel_layer.group_send)(
-		document.hash_value,
-		{
-			'type': 'update_preview',
-			'message': text,
-		}
-	)
+	# previews change with every keystroke, so they are not worth caching for long
+	rendered_text = get_cached_preview(hash_value, language, text)
+	if rendered_text is not None:
+		return HttpResponse(rendered_text, content_type='text/plain')
+	rendered_text, __ = render_markdown(text)
+
+	if is_superseded(hash_value, language, request_number):
+		# a newer text arrived while this one was rendered
+		response = HttpResponse(status=204)
+		del response['Content-Type']
+		return response
+	publish_preview(hash_value, language, text, rendered_text)
 
-	return HttpResponse(text, content_type='text/plain')
+	return HttpResponse(rendered_text, content_type='text/plain')
 
 
 def search(request):
@@ -266,26 +312,21 @@ def search(request):
 	id_only = request.GET.get('id_only', False)
 
 	query = request.GET['q']
+	search_backend = get_search_backend()
 	minutes = get_objects_for_user(
 		request.user,
 		MinutesDocument.VIEW_PERMISSION_NAME,
-		klass=MinutesDocument.objects.filter(
-			Q(title_de__icontains=query) | Q(title_en__icontains=query)
-		)
+		klass=search_backend.filter(MinutesDocument.objects.all(), query, TITLE_FIELDS).order_by('search_rank')
 	)
 	information_documents = get_objects_for_user(
 		request.user,
 		InformationDocument.VIEW_PERMISSION_NAME,
-		klass=InformationDocument.objects.filter(
-			Q(title_de__icontains=query) | Q(title_en__icontains=query)
-		)
+		klass=search_backend.filter(InformationDocument.objects.all(), query, TITLE_FIELDS).order_by('search_rank')
 	)
 	polls = get_objects_for_user(
 		request.user,
 		Poll.VIEW_PERMISSION_NAME,
-		klass=Poll.objects.filter(
-			Q(title_de__icontains=query) | Q(title_en__icontains=query)
-		)
+		klass=search_backend.filter(Poll.objects.all(), query, TITLE_FIELDS).order_by('search_rank')
 	)
 
 	return render(request, "ajax_search_api.json", {
@@ -300,63 +341,18 @@ def revert(request):
 	if not request.is_ajax() or not request.POST:
 		raise Http404
 
-	version_id = request.POST['id']
-	document_url_title = request.POST['url_title']
-	document = get_object_or_404(Document, url_title=document_url_title)
+	document = get_object_or_404(Document, url_title=request.POST['url_title'])
 	check_permissions(document, request.user, [document.edit_permission_name])
-	versions = Version.objects.get_for_object(document)
 
 	if not document.can_be_reverted:
 		raise SuspiciousOperation('This Document can not be reverted!')
 
-	# find the we want to revert to
-	revert_version = None
-	for version in versions:
-		if version.pk == int(version_id):
-			revert_version = version
-			break
-
-	if revert_version is None:
-		# user supplied version_id that does not exist
+	try:
+		version_id = int(request.POST['id'])
+	except ValueError:
 		raise SuspiciousOperation('Could not find document')
 
-	revert_version.revision.revert(delete=False)
-	fields = revert_version.field_dict
-	document_class = ContentType.objects.get_for_id(fields.pop('polymorphic_ctype_id')).model_class()
-
-	# Remove all references to parent objects, rename ForeignKeyFields, extract ManyToManyFields.
-	new_fields = fields.copy()
-	many_to_many_fields = {}
-	for key in fields.keys():
-		if "_ptr" in key:
-			del new_fields[key]
-			continue
-
-		try:
-			field = getattr(document_class, key).field
-		except AttributeError:
-			continue
-
-		if isinstance(field, models.ManyToManyField):
-			many_to_many_fields[key] = fields[key]
-			del new_fields[key]
-		else:
-			new_fields[field.attname] = fields[key]
-
-	reverted_document = document_class(**new_fields)
-	with transaction.atomic(), revisions.create_revision():
-		reverted_document.save()
-		# Restore ManyToManyFields
-		for key in many_to_many_fields.keys():
-			getattr(reverted_document, key).clear()
-			getattr(reverted_document, key).add(*many_to_many_fields[key])
-		revisions.set_user(request.user)
-		revisions.set_comment(
-			_('reverted to revision \"{revision_comment}\" (at {date})'.format(
-				revision_comment=revert_version.revision.get_comment(),
-				date=datetime.utcnow().strftime("%Y-%m-%d %H:%M"),
-			))
-		)
+	reverted_document = revert_document(document, version_id, request.user)
 	return HttpResponse(reverse('versions', args=[reverted_document.url_title]))
 
 
@@ -527,6 +523,7 @@ def preview(request):
 			'text': text,
 			'preview_url': settings.PREVIEW_URL,
 			'hash_value': hash_value,
+			'language': get_language().split('-')[0],
 			'view_page': True,
 		}
 	)
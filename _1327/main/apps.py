@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class MainConfig(AppConfig):
+	name = '_1327.main'
+
+	def ready(self):
+		import _1327.main.checks  # noqa
@@ -0,0 +1,16 @@
+from django.core.checks import register, Tags, Warning
+
+from _1327.main.utils import cache_is_shared
+
+
+@register(Tags.caches, deploy=True)
+def check_cache_is_shared(app_configs, **kwargs):
+	if cache_is_shared():
+		return []
+	return [
+		Warning(
+			"The default cache is a local-memory cache, which is not shared between processes.",
+			hint="Configure a shared cache like Redis in CACHES, otherwise processes keep serving outdated markdown, menus and permissions.",
+			id='1327.W001',
+		)
+	]
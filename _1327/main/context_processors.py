@@ -1,32 +1,118 @@
+from collections import defaultdict
+import hashlib
+
 from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.functional import cached_property
 from guardian.shortcuts import get_objects_for_user
 
 from _1327.main.models import MenuItem
-from . import models
+from _1327.main.tools import translate
+from _1327.main.utils import get_cache_generation, MENU_CACHE_GENERATION_KEY
+from _1327.user_management.permissions import get_shared_permission_generation, has_pending_permission_changes
+
+
+class MenuNode:
+	"""
+		the part of a menu item that is needed to render the menu, can be cached
+	"""
+	title = translate(en='title_en', de='title_de')
+
+	def __init__(self, menu_item, submenu):
+		self.id = menu_item.id
+		self.title_de = menu_item.title_de
+		self.title_en = menu_item.title_en
+		self.link = menu_item.link
+		self.document_url_title = menu_item.document.url_title if menu_item.document else None
+		self.url = menu_item.get_url()
+		self.submenu = submenu
+		self.selected = False
+
+	def get_url(self):
+		return self.url
+
+
+def build_menu(user):
+	menu_items = list(MenuItem.objects.prefetch_related('document'))
+	permission_checker = getattr(user, '_permission_checker', None)
+	if permission_checker is not None:
+		permission_checker.prefetch(menu_items)
+
+	children = defaultdict(list)
+	for menu_item in menu_items:
+		children[menu_item.parent_id].append(menu_item)
+
+	def build_nodes(items):
+		return [MenuNode(item, build_nodes(children[item.id])) for item in items if item.can_view(user)]
+
+	root_items = children[None]
+	main_menu = build_nodes([item for item in root_items if item.menu_type == MenuItem.MAIN_MENU])
+	footer = build_nodes([item for item in menu_items if item.menu_type == MenuItem.FOOTER])
+	return main_menu, footer
+
+
+def has_own_menu_permissions(user):
+	content_type = ContentType.objects.get_for_model(MenuItem)
+	return Permission.objects.filter(content_type=content_type).filter(Q(user=user) | Q(userobjectpermission__user=user)).exists()
+
+
+def get_permission_profile(user):
+	"""
+		identifies the permissions that decide which menu items the user can see,
+		users with permissions of their own for menu items get a menu of their own
+	"""
+	if user.is_superuser:
+		profile = 'superuser'
+	elif user.is_authenticated and has_own_menu_permissions(user):
+		profile = 'user_{}'.format(user.pk)
+	elif user.is_authenticated:
+		profile = 'groups_' + '_'.join(str(group_id) for group_id in sorted(user.groups.values_list('id', flat=True)))
+	else:
+		profile = 'anonymous'
+	ip_range_group_name = getattr(user, '_ip_range_group_name', None)
+	if ip_range_group_name:
+		profile += '_' + ip_range_group_name
+	return hashlib.md5(profile.encode()).hexdigest()
+
+
+def get_menu(user):
+	"""
+		returns the main menu and the footer items visible for the user.
+		the visible menu is cached per permission profile for the current menu and object permission generation,
+		so that any change of the menu or permissions invalidates it.
+	"""
+	if has_pending_permission_changes():
+		# the menu must not be shared before the permissions it depends on are committed
+		return build_menu(user)
+
+	cache_key = 'menu_{}_{}_{}'.format(
+		get_cache_generation(MENU_CACHE_GENERATION_KEY),
+		get_shared_permission_generation(),
+		get_permission_profile(user),
+	)
+	menu = cache.get(cache_key)
+	if menu is None:
+		menu = build_menu(user)
+		cache.set(cache_key, menu, settings.MENU_CACHE_TIMEOUT)
+	return menu
 
 
 def menu(request):
-	menu_items = models.MenuItem.objects.filter(menu_type=models.MenuItem.MAIN_MENU, parent=None)
-	menu_items = [menu_item for menu_item in menu_items if menu_item.can_view(request.user)]
-
-	for item in menu_items:
-		mark_selected(request, item)
-
-	footer_items = models.MenuItem.objects.filter(menu_type=models.MenuItem.FOOTER)
-	footer_items = [footer_item for footer_item in footer_items if footer_item.can_view(request.user)]
-
-	for item in footer_items:
+	# the cache returns a new copy of the menu, so marking the selected items does not affect other requests
+	main_menu, footer = get_menu(request.user)
+	for item in main_menu + footer:
 		mark_selected(request, item)
 
 	return {
-		'main_menu': menu_items,
-		'footer': footer_items,
+		'main_menu': main_menu,
+		'footer': footer,
 	}
 
 
 def mark_selected(request, menu_item):
-	menu_item.submenu = menu_item.children.all()
-	menu_item.submenu = [submenu_item for submenu_item in menu_item.submenu if submenu_item.can_view(request.user)]
 	found_selected = False
 	for child in menu_item.submenu:
 		if mark_selected(request, child):
@@ -47,26 +133,47 @@ def mark_selected(request, menu_item):
 			if item_view.startswith('admin:') and current_view_name.startswith('admin:'):
 				menu_item.selected = True
 				return True
-		elif menu_item.document:
-			if 'title' in request.resolver_match.kwargs and menu_item.document.url_title == request.resolver_match.kwargs['title']:
+		elif menu_item.document_url_title:
+			if 'title' in request.resolver_match.kwargs and menu_item.document_url_title == request.resolver_match.kwargs['title']:
 				menu_item.selected = True
 				return True
 
 
-def can_create_informationpage(request):
-	return {'CAN_CREATE_INFORMATIONPAGE': request.user.has_perm("information_pages.add_informationdocument")}
+class Capabilities:
+	"""
+		what the user of a request is allowed to create or change.
+		every flag is only computed when a template reads it.
+	"""
+
+	def __init__(self, user):
+		self.user = user
+
+	@cached_property
+	def can_create_informationpage(self):
+		return self.user.has_perm("information_pages.add_informationdocument")
 
+	@cached_property
+	def minutes_groups(self):
+		return list(self.user.groups.filter(permissions__codename="add_minutesdocument"))
 
-def can_create_minutes(request):
-	return {'CAN_CREATE_MINUTES': request.user.groups.filter(permissions__codename="add_minutesdocument")}
+	@cached_property
+	def can_create_minutes(self):
+		return len(self.minutes_groups) > 0
 
+	@cached_property
+	def can_create_poll(self):
+		return self.user.has_perm("polls.add_poll")
 
-def can_create_poll(request):
-	return {'CAN_CREATE_POLL': request.user.has_perm("polls.add_poll")}
+	@cached_property
+	def can_change_menu_items(self):
+		return self.user.is_superuser or get_objects_for_user(self.user, MenuItem.CHANGE_CHILDREN_PERMISSION_NAME, klass=MenuItem).exists()
 
 
-def can_change_menu_items(request):
-	return {'CAN_CHANGE_MENU_ITEMS': request.user.is_superuser or len(get_objects_for_user(request.user, MenuItem.CHANGE_CHILDREN_PERMISSION_NAME, klass=MenuItem)) > 0}
+def capabilities(request):
+	# context processors run for every rendered template, the capabilities are shared by all of them
+	if not hasattr(request, '_capabilities'):
+		request._capabilities = Capabilities(request.user)
+	return {'CAPABILITIES': request._capabilities}
 
 
 def image_paths(request):
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from _1327.documents.models import Document
+from _1327.documents.version_storage import compress_document_history
+
+
+class Command(BaseCommand):
+	args = ''
+	help = 'Stores the texts of existing document versions as compressed changes, keeping every REVISION_SNAPSHOT_INTERVAL-th version complete'
+
+	def handle(self, *args, **options):
+		compressed_versions = 0
+		for document_id in Document.objects.non_polymorphic().values_list('pk', flat=True).iterator():
+			with transaction.atomic():
+				compressed_versions += compress_document_history(document_id)
+
+		self.stdout.write('Compressed the texts of {} versions.'.format(compressed_versions))
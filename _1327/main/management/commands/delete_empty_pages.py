@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from _1327.documents.models import Document
+from _1327.documents.utils import delete_old_empty_pages
+
+
+class Command(BaseCommand):
+	args = ''
+	help = 'Deletes documents that were created more than DELETE_EMPTY_PAGE_AFTER ago but never saved, should be run periodically'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=500, help='Number of pages that are deleted at once')
+
+	def handle(self, *args, **options):
+		start_time = time.monotonic()
+		deleted_objects, batches = delete_old_empty_pages(options['batch_size'])
+		duration = time.monotonic() - start_time
+
+		self.stdout.write('Deleted {} empty pages in {} batches in {:.2f} seconds.'.format(
+			deleted_objects[Document._meta.label], batches, duration,
+		))
+		for model_label, count in sorted(deleted_objects.items()):
+			self.stdout.write('  {}: {}'.format(model_label, count))
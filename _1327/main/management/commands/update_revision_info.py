@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from reversion.models import Version
+
+from _1327.documents.models import Document, DocumentRevisionInfo
+
+
+class Command(BaseCommand):
+	args = ''
+	help = 'Recomputes the stored revision information (last change, last author, number of revisions) of all documents'
+
+	def handle(self, *args, **options):
+		updated_documents = 0
+		for document in Document.objects.non_polymorphic().iterator():
+			versions = Version.objects.get_for_object(document).select_related('revision')
+			last_version = versions.order_by('revision__date_created').last()
+			if last_version is None:
+				DocumentRevisionInfo.objects.filter(document=document).delete()
+				continue
+
+			DocumentRevisionInfo.objects.update_or_create(document=document, defaults={
+				'last_change': last_version.revision.date_created,
+				'last_author_id': last_version.revision.user_id,
+				'revision_count': versions.count(),
+			})
+			updated_documents += 1
+
+		self.stdout.write('Updated the revision information of {} documents.'.format(updated_documents))
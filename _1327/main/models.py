@@ -2,6 +2,8 @@ from collections import namedtuple
 
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 
@@ -9,6 +11,7 @@ from guardian.shortcuts import assign_perm
 
 from _1327.documents.models import Document
 from _1327.main.tools import translate
+from _1327.main.utils import bump_markdown_cache_generation, bump_menu_cache_generation
 
 MENUITEM_VIEW_PERMISSION_NAME = 'view_menuitem'
 MENUITEM_EDIT_PERMISSION_NAME = 'change_menuitem'
@@ -120,3 +123,16 @@ class AbbreviationExplanation(models.Model):
 
 	def __str__(self):
 		return '*[' + self.abbreviation + ']: ' + self.explanation
+
+
+@receiver(post_save, sender=AbbreviationExplanation, dispatch_uid="abbreviation_saved")
+@receiver(post_delete, sender=AbbreviationExplanation, dispatch_uid="abbreviation_deleted")
+def invalidate_rendered_markdown(sender, **kwargs):
+	# abbreviations are appended to every rendered text, so all cached renderings are outdated now
+	bump_markdown_cache_generation()
+
+
+@receiver(post_save, sender=MenuItem, dispatch_uid="menu_item_saved")
+@receiver(post_delete, sender=MenuItem, dispatch_uid="menu_item_deleted")
+def invalidate_cached_menus(sender, **kwargs):
+	bump_menu_cache_generation()
@@ -4,23 +4,30 @@ import json
 import re
 
 from django.conf import settings
-from django.contrib.auth.models import Group
+from django.contrib.auth.models import Group, Permission
 from django.core import mail, management
 from django.core.management import call_command
-from django.test import override_settings, RequestFactory, TestCase
+from django.db import transaction
+from django.test import override_settings, RequestFactory, TestCase, TransactionTestCase
 from django.urls import reverse
-from django.utils import translation
+from django.utils import timezone, translation
 from django_webtest import WebTest
 from guardian.shortcuts import assign_perm, remove_perm
 from guardian.utils import get_anonymous_user
 from model_bakery import baker
+from reversion import revisions
+from reversion.models import Version
 
+from _1327.documents.models import Document, DocumentRevisionInfo, TemporaryDocumentText
+from _1327.documents.version_storage import get_text_delta, get_text_version, get_version_texts
 from _1327.information_pages.models import InformationDocument
+from _1327.main.models import AbbreviationExplanation
 from _1327.main.tools import translate
-from _1327.main.utils import alternative_emails, convert_markdown, find_root_menu_items
+from _1327.main.utils import alternative_emails, convert_markdown, find_root_menu_items, get_markdown_engine, render_markdown
 from _1327.minutes.models import MinutesDocument
 from _1327.user_management.models import UserProfile
-from .context_processors import mark_selected
+from .checks import check_cache_is_shared
+from .context_processors import capabilities as capabilities_context_processor, mark_selected, menu, MenuNode
 from .models import MenuItem
 
 
@@ -32,11 +39,99 @@ class TestMenuProcessor(TestCase):
 
 		menu_item = baker.make(MenuItem)
 		try:
-			mark_selected(request, menu_item)
+			mark_selected(request, MenuNode(menu_item, []))
 		except AttributeError:
 			self.fail("mark_selected() raises an AttributeError")
 
 
+class TestMenuCache(TransactionTestCase):
+	"""
+		menus are only cached while no permission changes are pending, so the changes in these tests are committed
+	"""
+
+	def test_menu_is_cached(self):
+		rf = RequestFactory()
+		request = rf.get('/')
+		request.user = get_anonymous_user()
+		menu_item = baker.make(MenuItem, menu_type=MenuItem.MAIN_MENU)
+		assign_perm(menu_item.view_permission_name, request.user, menu_item)
+
+		self.assertEqual([item.id for item in menu(request)['main_menu']], [menu_item.id])
+		# the user has a permission of its own, so only those are read
+		with self.assertNumQueries(1):
+			self.assertEqual([item.id for item in menu(request)['main_menu']], [menu_item.id])
+
+		menu_item.title_en = "Changed"
+		menu_item.save()
+		with translation.override('en'):
+			self.assertEqual([item.title for item in menu(request)['main_menu']], ["Changed"])
+
+		remove_perm(menu_item.view_permission_name, request.user, menu_item)
+		self.assertEqual(menu(request)['main_menu'], [])
+
+	def test_menu_is_shared_by_users_with_the_same_groups(self):
+		group = baker.make(Group)
+		menu_item = baker.make(MenuItem, menu_type=MenuItem.MAIN_MENU)
+		assign_perm(menu_item.view_permission_name, group, menu_item)
+		users = baker.make(UserProfile, _quantity=2)
+		for user in users:
+			user.groups.set([group])
+
+		request = RequestFactory().get('/')
+		request.user = users[0]
+		self.assertEqual([item.id for item in menu(request)['main_menu']], [menu_item.id])
+		# only the groups and the own permissions of the other user are read
+		request.user = users[1]
+		with self.assertNumQueries(2):
+			self.assertEqual([item.id for item in menu(request)['main_menu']], [menu_item.id])
+
+		request.user = baker.make(UserProfile)
+		self.assertEqual(menu(request)['main_menu'], [])
+
+	def test_menu_of_users_with_own_permissions_is_not_shared(self):
+		group = baker.make(Group)
+		menu_item = baker.make(MenuItem, menu_type=MenuItem.MAIN_MENU)
+		users = baker.make(UserProfile, _quantity=2)
+		for user in users:
+			user.groups.set([group])
+		assign_perm(menu_item.view_permission_name, users[0], menu_item)
+
+		request = RequestFactory().get('/')
+		request.user = users[0]
+		self.assertEqual([item.id for item in menu(request)['main_menu']], [menu_item.id])
+		request.user = users[1]
+		self.assertEqual(menu(request)['main_menu'], [])
+		request.user = users[0]
+		self.assertEqual([item.id for item in menu(request)['main_menu']], [menu_item.id])
+
+
+class TestCapabilities(TestCase):
+
+	def test_capabilities_are_lazy(self):
+		request = RequestFactory().get('/')
+		request.user = baker.make(UserProfile)
+		group = baker.make(Group)
+		group.permissions.add(Permission.objects.get(codename="add_minutesdocument"))
+		request.user.groups.add(group)
+
+		with self.assertNumQueries(0):
+			capabilities = capabilities_context_processor(request)['CAPABILITIES']
+			self.assertIs(capabilities_context_processor(request)['CAPABILITIES'], capabilities)
+
+		self.assertFalse(capabilities.can_change_menu_items)
+		self.assertTrue(capabilities.can_create_minutes)
+		with self.assertNumQueries(0):
+			self.assertFalse(capabilities.can_change_menu_items)
+			self.assertEqual(capabilities.minutes_groups, [group])
+
+	def test_management_menu(self):
+		user = baker.make(UserProfile, is_superuser=True)
+		self.client.force_login(user)
+		response = self.client.get(reverse('index'))
+		self.assertContains(response, reverse('documents:create', args=['poll']))
+		self.assertContains(response, reverse('menu_items_index'))
+
+
 class MainPageTests(WebTest):
 
 	def test_main_page_no_page_set(self):
@@ -608,6 +703,89 @@ class TestSendRemindersCommand(TestCase):
 		self.assertEqual(len(mail.outbox), 2)
 
 
+class TestUpdateRevisionInfoCommand(TestCase):
+
+	def test_update_revision_info(self):
+		user = baker.make(UserProfile)
+		document = baker.prepare(InformationDocument)
+		for comment in ['first version', 'second version']:
+			with transaction.atomic(), revisions.create_revision():
+				document.save()
+				revisions.set_user(user)
+				revisions.set_comment(comment)
+		document_without_versions = baker.make(InformationDocument)
+		DocumentRevisionInfo.objects.all().delete()
+
+		management.call_command('update_revision_info', stdout=StringIO())
+
+		document = InformationDocument.objects.get(pk=document.pk)
+		self.assertEqual(document.revision_count, 2)
+		self.assertEqual(document.last_author, user)
+		self.assertEqual(document.last_change, Version.objects.get_for_object(document).first().revision.date_created)
+		self.assertEqual(InformationDocument.objects.get(pk=document_without_versions.pk).revision_count, 0)
+
+
+class TestCompressRevisionsCommand(TestCase):
+
+	@override_settings(REVISION_SNAPSHOT_INTERVAL=3)
+	def test_compress_revisions(self):
+		document = baker.prepare(InformationDocument)
+		texts = ['first line\r\nsecond line', 'first line\r\nchanged line\r\n', '', 'new text', 'new text\nand more']
+		for text in texts:
+			document.text_de = text
+			with transaction.atomic(), revisions.create_revision():
+				document.save()
+
+		management.call_command('compress_revisions', stdout=StringIO())
+
+		# every third version keeps its full texts
+		versions = Version.objects.get_for_object(document).order_by('pk')
+		self.assertEqual([get_text_delta(get_text_version(version)) is not None for version in versions], [False, True, True, False, True])
+		for version, text in zip(versions, texts):
+			self.assertEqual(get_version_texts(version)['text_de'], text)
+
+		# the deltas of a version are fetched at once, however long its chain is
+		with self.assertNumQueries(4):
+			get_version_texts(versions[2])
+
+		output = StringIO()
+		management.call_command('compress_revisions', stdout=output)
+		self.assertIn('Compressed the texts of 0 versions.', output.getvalue())
+
+
+class TestDeleteEmptyPagesCommand(TestCase):
+
+	def test_delete_empty_pages(self):
+		user = baker.make(UserProfile)
+		old_date = timezone.now() - settings.DELETE_EMPTY_PAGE_AFTER - datetime.timedelta(minutes=1)
+		empty_pages = baker.make(InformationDocument, _quantity=3)
+		saved_page = baker.make(InformationDocument)
+		with transaction.atomic(), revisions.create_revision():
+			saved_page.save()
+		autosaved_page = baker.make(InformationDocument)
+		baker.make(TemporaryDocumentText, document=autosaved_page, author=user)
+		Document.objects.update(created=old_date)
+		new_page = baker.make(InformationDocument)
+
+		output = StringIO()
+		management.call_command('delete_empty_pages', batch_size=2, stdout=output)
+
+		self.assertIn('Deleted 3 empty pages in 2 batches', output.getvalue())
+		self.assertFalse(Document.objects.filter(pk__in=[page.pk for page in empty_pages]).exists())
+		self.assertEqual(set(Document.objects.all()), {saved_page, autosaved_page, new_page})
+
+
+class TestCacheCheck(TestCase):
+
+	@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+	def test_local_memory_cache(self):
+		self.assertEqual([warning.id for warning in check_cache_is_shared(None)], ['1327.W001'])
+
+	@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/1327_cache'}})
+	def test_shared_cache(self):
+		self.assertEqual(check_cache_is_shared(None), [])
+
+
 class TestMissingMigrations(TestCase):
 	def test_for_missing_migrations(self):
 		output = StringIO()
@@ -744,3 +922,43 @@ class TestConvertMarkdown(TestCase):
 		toc = convert_markdown(text)[1]
 		self.assertNotIn('javascript', toc)
 		self.assertIn('>Click me!</a>', toc)
+
+	def test_rendered_markdown_is_cached(self):
+		text = 'cached text'
+		html = convert_markdown(text)
+		with self.assertNumQueries(0):
+			self.assertEqual(convert_markdown(text), html)
+
+	def test_abbreviation_change_invalidates_cache(self):
+		text = 'some FSR text'
+		self.assertNotIn('<abbr', convert_markdown(text)[0])
+
+		abbreviation = baker.make(AbbreviationExplanation, abbreviation='FSR', explanation='Fachschaftsrat')
+		self.assertIn('<abbr title="Fachschaftsrat">FSR</abbr>', convert_markdown(text)[0])
+
+		abbreviation.delete()
+		self.assertNotIn('<abbr', convert_markdown(text)[0])
+
+	def test_link_target_change_invalidates_cache(self):
+		document = baker.make(InformationDocument, url_title='old-url')
+		text = '[link](document:{})'.format(document.id)
+		self.assertIn('/old-url', convert_markdown(text)[0])
+
+		document.url_title = 'new-url'
+		document.save()
+		self.assertIn('/new-url', convert_markdown(text)[0])
+
+		document.delete()
+		self.assertIn('[missing link]', convert_markdown(text)[0])
+
+	def test_markdown_engine_is_reused(self):
+		self.assertIs(get_markdown_engine(), get_markdown_engine())
+
+	def test_reused_engine_does_not_leak_state(self):
+		html, toc = render_markdown('## Heading\n\n*[ABC]: alphabet\n\nABC')
+		self.assertIn('<abbr title="alphabet">ABC</abbr>', html)
+		self.assertIn('Heading', toc)
+
+		html, toc = render_markdown('ABC')
+		self.assertNotIn('<abbr', html)
+		self.assertNotIn('Heading', toc)
@@ -1,23 +1,35 @@
+from collections import defaultdict
+import hashlib
 import re
+import threading
+import time
 
 import bleach
 
 from django.conf import settings
 from django.contrib.auth.models import Group
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
 from django.core.exceptions import ValidationError
 from django.utils.text import slugify as django_slugify
-from django.utils.translation import gettext_lazy as _
+from django.utils.translation import get_language, gettext_lazy as _
 
-from guardian.core import ObjectPermissionChecker
+from guardian.models import GroupObjectPermission
 
 import markdown
 from markdown.extensions import Extension
+from markdown.extensions.abbr import ABBR_REF_RE
 from markdown.extensions.toc import TocExtension
 from markdown.postprocessors import Postprocessor
+from markdown.preprocessors import Preprocessor
 
 
 URL_TITLE_REGEX = re.compile(r'^[a-zA-Z0-9-_\/]*$')
 
+MARKDOWN_CACHE_GENERATION_KEY = 'markdown_generation'
+MENU_CACHE_GENERATION_KEY = 'menu_generation'
+
 
 def save_main_menu_item_order(main_menu_items, user, parent_id=None):
 	from .models import MenuItem
@@ -111,9 +123,45 @@ class EscapeHtml(Extension):
 		md.postprocessors.register(BleachPostprocessor(), 'bleach', -1000)
 
 
-def convert_markdown(text):
+class AbbreviationNamesPreprocessor(Preprocessor):
+	"""
+		records the names of the inline patterns that the abbr extension registers for the abbreviations of a text
+	"""
+
+	def __init__(self, md, pattern_names):
+		super().__init__(md)
+		self.pattern_names = pattern_names
+
+	def run(self, lines):
+		for line in lines:
+			match = ABBR_REF_RE.match(line)
+			if match:
+				self.pattern_names.add('abbr-%s' % match.group('abbr').strip())
+		return lines
+
+
+class ResetAbbreviations(Extension):
+	# The abbr extension registers an inline pattern for every abbreviation it finds in a text.
+	# These patterns are not removed by Markdown.reset(), so we have to do it before an engine is reused.
+	def extendMarkdown(self, md):
+		self.md = md
+		self.pattern_names = set()
+		# runs right before the preprocessor of the abbr extension
+		md.preprocessors.register(AbbreviationNamesPreprocessor(md, self.pattern_names), 'abbr_names', 13)
+		md.registerExtension(self)
+
+	def reset(self):
+		for name in self.pattern_names:
+			self.md.inlinePatterns.deregister(name, strict=False)
+		self.pattern_names.clear()
+
+
+_markdown_engines = threading.local()
+
+
+def create_markdown_engine():
 	from _1327.documents.markdown_internal_link_extension import InternalLinksMarkdownExtension
-	md = markdown.Markdown(
+	return markdown.Markdown(
 		extensions=[
 			EscapeHtml(),
 			TocExtension(baselevel=2),
@@ -122,9 +170,81 @@ def convert_markdown(text):
 			'_1327.documents.markdown_scaled_image_extension',
 			'markdown.extensions.abbr',
 			'markdown.extensions.tables',
+			ResetAbbreviations(),
 		],
 		output_format='html5'
 	)
+
+
+def get_markdown_engine():
+	"""
+		returns a markdown engine that is reused for all conversions of the current thread
+	"""
+	engine = getattr(_markdown_engines, 'engine', None)
+	if engine is None:
+		engine = _markdown_engines.engine = create_markdown_engine()
+	return engine.reset()
+
+
+def cache_is_shared():
+	"""
+		whether all processes use the same default cache, which the cache generations below rely on
+	"""
+	return not isinstance(caches['default'], LocMemCache)
+
+
+def get_cache_generation(key):
+	"""
+		returns the counter stored at the key, cache entries that contain it in their key are outdated once it changes
+	"""
+	generation = cache.get(key)
+	if generation is None:
+		# start from the current time so that a lost counter never reuses the generation of old cache entries
+		cache.add(key, time.time_ns(), None)
+		generation = cache.get(key)
+	return generation
+
+
+def bump_cache_generation(key):
+	try:
+		cache.incr(key)
+	except ValueError:
+		cache.set(key, time.time_ns(), None)
+
+
+def markdown_cache_generation():
+	return get_cache_generation(MARKDOWN_CACHE_GENERATION_KEY)
+
+
+def bump_markdown_cache_generation():
+	"""
+		invalidates all rendered markdown in the cache, e.g. after abbreviations or link targets changed
+	"""
+	bump_cache_generation(MARKDOWN_CACHE_GENERATION_KEY)
+
+
+def bump_menu_cache_generation():
+	"""
+		invalidates all cached menus, e.g. after a menu item or the url of a linked document changed
+	"""
+	bump_cache_generation(MENU_CACHE_GENERATION_KEY)
+
+
+def convert_markdown(text):
+	cache_key = 'markdown_{generation}_{language}_{digest}'.format(
+		generation=markdown_cache_generation(),
+		language=get_language(),
+		digest=hashlib.sha256(text.encode()).hexdigest(),
+	)
+	result = cache.get(cache_key)
+	if result is None:
+		result = render_markdown(text)
+		cache.set(cache_key, result, settings.MARKDOWN_CACHE_TIMEOUT)
+	return result
+
+
+def render_markdown(text):
+	md = get_markdown_engine()
 	return md.convert(text + abbreviation_explanation_markdown()), bleach.clean(md.toc, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, protocols=ALLOWED_PROTOCOLS)
 
 
@@ -188,6 +308,17 @@ def document_permission_overview(user, document):
 	if not can_edit:
 		return []
 
+	# load the permissions of all groups for this document at once
+	group_permissions = defaultdict(set)
+	group_object_permissions = GroupObjectPermission.objects.filter(
+		content_type=ContentType.objects.get_for_model(document),
+		object_pk=str(document.pk),
+	).values_list('group__name', 'permission__codename')
+	for group_name, codename in group_object_permissions:
+		group_permissions[group_name].add(codename)
+	edit_permission = document.edit_permission_name.split('.')[1]
+	view_permission = document.view_permission_name.split('.')[1]
+
 	main_groups = [
 		settings.ANONYMOUS_GROUP_NAME,
 		settings.UNIVERSITY_GROUP_NAME,
@@ -196,23 +327,18 @@ def document_permission_overview(user, document):
 	]
 	permissions = []
 	for group_name in main_groups:
-		group = Group.objects.get(name=group_name)
-		checker = ObjectPermissionChecker(group)
-		checker.prefetch_perms([document])
-		if checker.has_perm(document.edit_permission_name, document):
-			permissions.append((group.name, "edit"))
-		elif checker.has_perm(document.view_permission_name, document):
-			permissions.append((group.name, "view"))
+		if edit_permission in group_permissions[group_name]:
+			permissions.append((group_name, "edit"))
+		elif view_permission in group_permissions[group_name]:
+			permissions.append((group_name, "view"))
 		else:
-			permissions.append((group.name, "none"))
-
-	for group in Group.objects.exclude(name__in=main_groups):
-		checker = ObjectPermissionChecker(group)
-		checker.prefetch_perms([document])
-		if checker.has_perm(document.edit_permission_name, document):
-			permissions.append((group.name, "edit"))
-		elif checker.has_perm(document.view_permission_name, document):
-			permissions.append((group.name, "view"))
+			permissions.append((group_name, "none"))
+
+	for group_name in Group.objects.exclude(name__in=main_groups).values_list('name', flat=True):
+		if edit_permission in group_permissions[group_name]:
+			permissions.append((group_name, "edit"))
+		elif view_permission in group_permissions[group_name]:
+			permissions.append((group_name, "view"))
 
 	return permissions
 
@@ -0,0 +1,19 @@
+# Generated by Django 3.0.14 on 2026-10-18 02:19
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('minutes', '0012_rename_view_permission'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='minutesdocument',
+            name='date',
+            field=models.DateField(db_index=True, default=datetime.datetime.now, verbose_name='Date'),
+        ),
+    ]
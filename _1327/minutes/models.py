@@ -50,7 +50,7 @@ class MinutesDocument(Document):
 		(PUBLISHED_STUDENT, _('Published for Students only')),
 	)
 
-	date = models.DateField(default=datetime.now, verbose_name=_("Date"))
+	date = models.DateField(default=datetime.now, db_index=True, verbose_name=_("Date"))
 	state = models.IntegerField(choices=CHOICES, default=UNPUBLISHED, verbose_name=_("State"))
 	moderator = models.ForeignKey(UserProfile, on_delete=models.PROTECT, related_name='moderations', verbose_name=_("Moderator"), blank=True, null=True)
 	author = models.ForeignKey(UserProfile, on_delete=models.PROTECT, related_name='documents')
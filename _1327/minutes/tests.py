@@ -2,10 +2,13 @@ from unittest import TestCase
 
 from django.conf import settings
 from django.contrib.auth.models import Group
+from django.test import RequestFactory
 from django.urls import reverse
+from django.utils import translation
 from django_webtest import WebTest
 from guardian.core import ObjectPermissionChecker
 from guardian.shortcuts import assign_perm
+from guardian.utils import get_anonymous_user
 import markdown
 from model_bakery import baker
 from reversion.models import Version
@@ -15,6 +18,7 @@ from _1327.minutes.markdown_minutes_extensions import BreakPreprocessor, EnterLe
 	StartEndPreprocessor, VotePreprocessor
 
 from _1327.minutes.models import MinutesDocument
+from _1327.minutes.views import find_minutes_lines, get_permitted_minutes
 from _1327.user_management.models import UserProfile
 
 
@@ -241,6 +245,86 @@ class TestMinutesList(WebTest):
 		self.assertNotIn('No minutes available.', response.body.decode('utf-8'))
 		self.assertNotIn('You might have to', response.body.decode('utf-8'))
 
+	def test_list_permission_filter(self):
+		user = baker.make(UserProfile)
+		user_group = baker.make(Group)
+		user.groups.add(user_group)
+		ip_range_group = baker.make(Group)
+		user_minutes, anonymous_minutes, ip_range_minutes, hidden_minutes, other_group_minutes = baker.make(MinutesDocument, _quantity=5)
+		for document in [user_minutes, anonymous_minutes, ip_range_minutes, hidden_minutes]:
+			document.set_all_permissions(self.group)
+		assign_perm(user_minutes.view_permission_name, user_group, user_minutes)
+		assign_perm(anonymous_minutes.view_permission_name, get_anonymous_user(), anonymous_minutes)
+		assign_perm(ip_range_minutes.view_permission_name, ip_range_group, ip_range_minutes)
+		assign_perm(other_group_minutes.view_permission_name, user_group, other_group_minutes)
+
+		request = RequestFactory().get('/')
+		request.user = user
+		minutes, own_group = get_permitted_minutes(MinutesDocument.objects.all(), request, self.group.id)
+		self.assertFalse(own_group)
+		self.assertCountEqual(minutes, [user_minutes, anonymous_minutes])
+
+		request.user._ip_range_group_name = ip_range_group.name
+		minutes, __ = get_permitted_minutes(MinutesDocument.objects.all(), request, self.group.id)
+		with self.assertNumQueries(1):
+			self.assertCountEqual(minutes, [user_minutes, anonymous_minutes, ip_range_minutes])
+
+	def test_list_pagination(self):
+		for __ in range(3):
+			baker.make(MinutesDocument).set_all_permissions(self.group)
+
+		with self.settings(MINUTES_PER_PAGE=2):
+			response = self.app.get(reverse("minutes:list", args=[self.group.id]), user=self.user)
+			self.assertEqual(len(response.context['page']), 2)
+			self.assertIn("?page=2", response)
+
+			response = self.app.get(reverse("minutes:list", args=[self.group.id]) + "?page=2", user=self.user)
+			self.assertEqual(len(response.context['page']), 2)
+			self.assertNotIn("?page=3", response)
+
+	def test_list_json(self):
+		for date in ['2018-03-01', '2019-05-01', '2019-06-01']:
+			baker.make(MinutesDocument, date=date).set_all_permissions(self.group)
+		self.minutes_document.date = '2017-01-01'
+		self.minutes_document.save()
+
+		with self.settings(MINUTES_PER_PAGE=2):
+			response = self.app.get(reverse("minutes:list", args=[self.group.id]), user=self.user)
+			self.assertEqual(response.context['years'], [2019, 2018, 2017])
+
+			response = self.app.get(reverse("minutes:list_json", args=[self.group.id]), user=self.user)
+			self.assertEqual(response.json['next_page'], 2)
+			self.assertEqual(response.json['html'].count('<h3'), 1)
+
+			response = self.app.get(reverse("minutes:list_json", args=[self.group.id]) + "?page=2", user=self.user)
+			self.assertIsNone(response.json['next_page'])
+			self.assertIn('id="year2018"', response.json['html'])
+			self.assertIn('id="year2017"', response.json['html'])
+
+			response = self.app.get(reverse("minutes:list_json", args=[self.group.id]) + "?year=2018", user=self.user)
+			self.assertIsNone(response.json['next_page'])
+			self.assertEqual(response.json['html'].count('<tr>'), 1)
+
+			# pages beyond the last one are not answered with the last page again
+			for page in ['3', 'last']:
+				response = self.app.get(reverse("minutes:list_json", args=[self.group.id]) + "?page=" + page, user=self.user, expect_errors=True)
+				self.assertEqual(response.status_code, 404)
+
+	def test_year_heading_of_continued_year(self):
+		self.minutes_document.date = '2019-07-01'
+		self.minutes_document.save()
+		for date in ['2019-05-01', '2019-06-01']:
+			baker.make(MinutesDocument, date=date).set_all_permissions(self.group)
+
+		with self.settings(MINUTES_PER_PAGE=2):
+			# appended rows continue the year whose heading is shown already
+			response = self.app.get(reverse("minutes:list_json", args=[self.group.id]) + "?page=2", user=self.user)
+			self.assertNotIn('id="year2019"', response.json['html'])
+
+			# a page that is opened on its own shows the heading
+			response = self.app.get(reverse("minutes:list", args=[self.group.id]) + "?page=2", user=self.user)
+			self.assertIn('id="year2019"', response)
+
 
 class TestSearchMinutes(WebTest):
 	csrf_checks = False
@@ -397,6 +481,20 @@ class TestSearchMinutes(WebTest):
 
 		self.assertIn('<b>&lt;script&gt;alert(Hello);&lt;/script&gt;</b> something else', response.body.decode('utf-8'))
 
+	def test_results_are_streamed(self):
+		self.client.force_login(self.user)
+		response = self.client.post(reverse("minutes:search", args=[self.group.id]), {'search_phrase': "notB"})
+		self.assertTrue(response.streaming)
+		content = b''.join(response.streaming_content).decode('utf-8')
+		self.assertIn('MinutesOne', content)
+		self.assertIn('MinutesThree', content)
+		self.assertNotIn('MinutesFour', content)
+
+	def test_lines_per_document_are_capped(self):
+		with self.settings(MINUTES_SEARCH_LINES_PER_DOCUMENT=2), translation.override('de'):
+			lines = [lines for minutes, lines in find_minutes_lines(MinutesDocument.objects.filter(pk=self.minutes_document1.pk), "notB")][0]
+		self.assertEqual(lines, [' Case <b>notB</b> notO ', ' two <b>notB</b> notO '])
+
 
 class TestNewMinutesDocument(WebTest):
 	csrf_checks = False
@@ -11,6 +11,7 @@ register_converter(SlugWithSlashConverter, 'slugwithslash')
 
 urlpatterns = [
 	path("list/<int:groupid>", views.list, name="list"),
+	path("list/<int:groupid>/json", views.list_json, name="list_json"),
 	path("<slugwithslash:title>/edit", document_views.edit, name="edit"),
 	path("search/<int:groupid>", views.search, name="search"),
 ]
@@ -1,18 +1,29 @@
+from itertools import groupby, islice
 import re
 
+from django.conf import settings
 from django.contrib.auth.models import Group
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import Http404, redirect, render
+from django.template.loader import get_template, render_to_string
+from django.utils import translation
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
 from django.utils.translation import get_language
-from guardian.core import ObjectPermissionChecker
+from guardian.shortcuts import get_objects_for_group, get_objects_for_user
+from guardian.utils import get_anonymous_user
 
+from _1327.documents.search import get_search_backend, TEXT_FIELDS
 from _1327.minutes.forms import SearchForm
 from _1327.minutes.models import MinutesDocument
 
 
+SEARCH_RESULTS_PLACEHOLDER = mark_safe('<!-- search results -->')
+
+
 def get_permitted_minutes(minutes, request, groupid):
 	groupid = int(groupid)
 	try:
@@ -22,101 +33,162 @@ def get_permitted_minutes(minutes, request, groupid):
 
 	own_group = request.user.is_superuser or group in request.user.groups.all()
 
-	# Prefetch group permissions
-	group_checker = ObjectPermissionChecker(group)
-	group_checker.prefetch_perms(minutes)
-
-	# Prefetch user permissions
-	user_checker = ObjectPermissionChecker(request.user)
-	user_checker.prefetch_perms(minutes)
-
-	# Prefetch ip group permissions
-	ip_range_group_name = request.user._ip_range_group_name if hasattr(request.user, '_ip_range_group_name') else None
+	# we show all documents for which the requested group has edit permissions
+	# e.g. if you request FSR minutes, all minutes for which the FSR group has edit rights will be shown
+	edit_permission = "{}.change_{}".format(MinutesDocument._meta.app_label, MinutesDocument._meta.model_name)
+	minutes = get_objects_for_group(group, edit_permission, klass=minutes, accept_global_perms=False)
+
+	# we only show documents for which the user, the anonymous user or the ip range group has view permissions
+	if request.user.is_superuser:
+		return minutes, own_group
+	view_permission = MinutesDocument.get_view_permission()
+	viewable_minutes = [get_objects_for_user(request.user, view_permission, klass=MinutesDocument, accept_global_perms=False)]
+	if request.user.is_authenticated:
+		viewable_minutes.append(get_objects_for_user(get_anonymous_user(), view_permission, klass=MinutesDocument, accept_global_perms=False))
+	ip_range_group_name = getattr(request.user, '_ip_range_group_name', None)
 	if ip_range_group_name:
 		ip_range_group = Group.objects.get(name=ip_range_group_name)
-		ip_range_group_checker = ObjectPermissionChecker(ip_range_group)
-
-	permitted_minutes = []
-	for m in minutes:
-		# we show all documents for which the requested group has edit permissions
-		# e.g. if you request FSR minutes, all minutes for which the FSR group has edit rights will be shown
-		if not group_checker.has_perm(m.edit_permission_name, m):
-			continue
-		# we only show documents for which the user has view permissions
-		if not user_checker.has_perm(MinutesDocument.get_view_permission(), m) and (not ip_range_group_name or not ip_range_group_checker.has_perm(MinutesDocument.get_view_permission(), m)):
+		viewable_minutes.append(get_objects_for_group(ip_range_group, view_permission, klass=MinutesDocument, accept_global_perms=False))
+
+	condition = Q()
+	for queryset in viewable_minutes:
+		condition |= Q(pk__in=queryset.values('pk'))
+	return minutes.filter(condition), own_group
+
+
+def find_lines(text, pattern, highlight_pattern):
+	"""
+		yields the escaped lines of the text that match the pattern, with the matches marked bold
+	"""
+	line_end = -1
+	for match in pattern.finditer(text):
+		if match.start() <= line_end:
+			# the line of this match was found already
 			continue
-		permitted_minutes.append(m)
-
-	return permitted_minutes, own_group
+		line_start = text.rfind('\n', 0, match.start()) + 1
+		line_end = text.find('\n', match.end())
+		if line_end == -1:
+			line_end = len(text)
+		line = text[line_start:line_end].rstrip('\r')
+		yield mark_safe(highlight_pattern.sub(r'<b>\1</b>', escape(line)))
+
+
+def find_minutes_lines(minutes, search_text):
+	"""
+		yields every minutes document together with at most MINUTES_SEARCH_LINES_PER_DOCUMENT lines
+		containing the searched for string, only a few documents are loaded at once
+	"""
+	pattern = re.compile(re.escape(search_text), flags=re.IGNORECASE)
+	highlight_pattern = re.compile(r'(' + re.escape(escape(search_text)) + ')', flags=re.IGNORECASE)
+	current_language = get_language()
+
+	paginator = Paginator(minutes, settings.MINUTES_PER_PAGE)
+	for page_number in paginator.page_range:
+		for m in paginator.page(page_number):
+			lines = []
+			for language in ['de', 'en']:
+				lines_lang = find_lines(getattr(m, 'text_' + language), pattern, highlight_pattern)
+				# We're searching the string on all possible languages but if there's a match in a different language
+				# than the one selected it is highlighted in italics.
+				if not current_language.startswith(language):
+					lines_lang = (mark_safe('<i>' + line + '</i>') for line in lines_lang)
+				lines.extend(islice(lines_lang, settings.MINUTES_SEARCH_LINES_PER_DOCUMENT - len(lines)))
+			yield m, lines
 
 
 def search(request, groupid):
-	if request.method == 'POST':
-		form = SearchForm(request.POST)
-		if form.is_valid():
-			search_text = form.cleaned_data['search_phrase']
-	else:
+	form = SearchForm(request.POST or None)
+	if not form.is_valid():
 		# redirect to minutes list
 		return redirect("minutes:list", groupid=groupid)
+	search_text = form.cleaned_data['search_phrase']
 
 	# filter for documents that contain the searched for string
-	minutes = MinutesDocument.objects.filter(Q(text_de__icontains=search_text) | Q(text_en__icontains=search_text)).prefetch_related('labels').order_by('-date')
+	minutes = get_search_backend().filter(MinutesDocument.objects.all(), search_text, TEXT_FIELDS).prefetch_related('labels').order_by('-date', '-id')
 
 	# only show permitted documents
 	minutes, own_group = get_permitted_minutes(minutes, request, groupid)
+	years = [date.year for date in minutes.dates('date', 'year', order='DESC')]
 
-	# find lines containing the searched for string
-	result = {}
-	for m in minutes:
-		# find lines with the searched for string and mark it as bold
-		lines = []
-		for language in ['de', 'en']:
-			lines_lang = getattr(m, 'text_' + language).splitlines()
-
-			lines_lang = [
-				mark_safe(
-					re.sub(
-						r'(' + re.escape(escape(search_text)) + ')',
-						r'<b>\1</b>', escape(line),
-						flags=re.IGNORECASE
-					)
-				)
-				for line in lines_lang if (line.casefold().find(search_text.casefold()) != -1)
-			]
-
-			# We're searching the string on all possible languages but if there's a match in a different language
-			# than the one selected it is highlighted in italics.
-			if not get_language().startswith(language):
-				lines_lang = [mark_safe('<i>' + line + '</i>') for line in lines_lang]
-
-			lines += lines_lang
-
-		if m.date.year not in result:
-			result[m.date.year] = []
-
-		result[m.date.year].append((m, lines))
-
-	return render(request, "minutes_with_lines_list.html", {
-		'minutes_list': sorted(result.items(), reverse=True),
+	context = {
+		'years': years,
 		'own_group': own_group,
 		'group_id': groupid,
 		'search_form': SearchForm(),
 		'phrase': search_text,
-	})
-
-
-def list(request, groupid):
+		'results_placeholder': SEARCH_RESULTS_PLACEHOLDER,
+	}
+	if not years:
+		return render(request, "minutes_with_lines_list.html", context)
+
+	# the page is rendered around the results, which are streamed year by year
+	page_start, page_end = render_to_string("minutes_with_lines_list.html", context, request).split(SEARCH_RESULTS_PLACEHOLDER)
+	table_template = get_template("minutes_list_table.html")
+	language = get_language()
+
+	def stream_results():
+		yield page_start
+		with translation.override(language):
+			for year, minutes_lines in groupby(find_minutes_lines(minutes, search_text), key=lambda result: result[0].date.year):
+				yield table_template.render({
+					'minutes_list': [(year, [result for result in minutes_lines])],
+					'own_group': own_group,
+				})
+		yield page_end
+
+	return StreamingHttpResponse(stream_results())
+
+
+def get_minutes_page(request, groupid, exact_page=False):
 	minutes = MinutesDocument.objects.all().prefetch_related('labels').order_by('-date')
 	minutes, own_group = get_permitted_minutes(minutes, request, groupid)
+	years = [date.year for date in minutes.dates('date', 'year', order='DESC')]
+
+	year = request.GET.get('year')
+	if year is not None:
+		if not year.isdigit():
+			raise Http404
+		minutes = minutes.filter(date__year=int(year))
+	paginator = Paginator(minutes, settings.MINUTES_PER_PAGE)
+	if exact_page:
+		# pages that are appended to the list must not repeat the last page for numbers beyond it
+		try:
+			page = paginator.page(request.GET.get('page', 1))
+		except (EmptyPage, PageNotAnInteger):
+			raise Http404
+	else:
+		page = paginator.get_page(request.GET.get('page'))
 
 	result = {}
-	for m in minutes:
+	for m in page:
 		if m.date.year not in result:
 			result[m.date.year] = []
 		result[m.date.year].append((m, []))
-	return render(request, "minutes_list.html", {
+
+	return {
 		'minutes_list': sorted(result.items(), reverse=True),
+		'page': page,
+		'year': year,
+		'continued_year': None,
+		'years': years,
 		'own_group': own_group,
 		'group_id': groupid,
-		'search_form': SearchForm(),
+	}
+
+
+def list(request, groupid):
+	context = get_minutes_page(request, groupid)
+	context['search_form'] = SearchForm()
+	return render(request, "minutes_list.html", context)
+
+
+def list_json(request, groupid):
+	context = get_minutes_page(request, groupid, exact_page=True)
+	page = context['page']
+	if page.has_previous():
+		# the rows are appended to the list, which shows the heading of the last year of the previous page already
+		context['continued_year'] = page.paginator.object_list[page.start_index() - 2].date.year
+	return JsonResponse({
+		'html': render_to_string("minutes_list_table.html", context, request),
+		'next_page': page.next_page_number() if page.has_next() else None,
 	})
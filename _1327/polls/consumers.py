@@ -0,0 +1,33 @@
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import WebsocketConsumer
+
+from _1327.polls.models import Poll
+
+
+class PollResultsConsumer(WebsocketConsumer):
+
+	def connect(self):
+		poll = Poll.objects.filter(id=self.scope['url_route']['kwargs']['poll_id']).first()
+		if poll is None or not poll.results_can_be_seen_by(self.scope['user']):
+			self.close()
+			return
+
+		self.group_name = poll.results_group_name
+		async_to_sync(self.channel_layer.group_add)(
+			self.group_name,
+			self.channel_name,
+		)
+
+		self.accept()
+
+	def disconnect(self, message, **kwargs):
+		if not hasattr(self, 'group_name'):
+			return
+
+		async_to_sync(self.channel_layer.group_discard)(
+			self.group_name,
+			self.channel_name,
+		)
+
+	def update_results(self, event):
+		self.send(text_data=event['message'])
@@ -0,0 +1,70 @@
+import json
+import threading
+
+from asgiref.sync import async_to_sync
+import channels.layers
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from _1327.polls.models import Choice, Poll, PollStatistics
+
+
+def get_broadcast_key(poll_id):
+	return 'poll_results_broadcast_{}'.format(poll_id)
+
+
+def get_results_message(poll_id):
+	"""
+		returns the aggregated votes of the poll as they are sent to the viewers of its results
+	"""
+	statistics = PollStatistics.objects.filter(poll_id=poll_id).first() or PollStatistics.compute(poll_id)
+	participant_count = statistics.participant_count
+	return json.dumps({
+		'participant_count': participant_count,
+		'vote_count': statistics.vote_count,
+		'choices': [
+			{
+				'id': choice_id,
+				'votes': votes,
+				'percentage': votes * 100 / participant_count if participant_count else 0,
+			}
+			for choice_id, votes in Choice.objects.filter(poll_id=poll_id).values_list('id', 'votes')
+		],
+	})
+
+
+def broadcast_results(poll_id):
+	# votes that are counted from now on schedule the next broadcast
+	cache.delete(get_broadcast_key(poll_id))
+	channel_layer = channels.layers.get_channel_layer()
+	async_to_sync(channel_layer.group_send)(
+		Poll.get_results_group_name(poll_id),
+		{
+			'type': 'update_results',
+			'message': get_results_message(poll_id),
+		}
+	)
+
+
+def broadcast_results_in_thread(poll_id):
+	try:
+		broadcast_results(poll_id)
+	finally:
+		# the thread must not keep its database connection open
+		connection.close()
+
+
+def schedule_results_broadcast(poll_id):
+	"""
+		sends the results of the poll to its viewers after POLL_RESULTS_BROADCAST_INTERVAL seconds,
+		all votes that are counted until then are sent with the same broadcast
+	"""
+	interval = settings.POLL_RESULTS_BROADCAST_INTERVAL
+	# the key expires by itself in case the process ends before the broadcast is sent
+	if not cache.add(get_broadcast_key(poll_id), True, 2 * interval):
+		return
+
+	timer = threading.Timer(interval, broadcast_results_in_thread, args=[poll_id])
+	timer.daemon = True
+	timer.start()
@@ -0,0 +1,37 @@
+# Generated by Django 3.0.14 on 2026-10-18 02:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+def compute_poll_statistics(apps, schema_editor):
+    Poll = apps.get_model('polls', 'Poll')
+    PollStatistics = apps.get_model('polls', 'PollStatistics')
+    PollStatistics.objects.bulk_create([
+        PollStatistics(
+            poll=poll,
+            participant_count=poll.participants.count(),
+            vote_count=poll.choices.aggregate(Sum('votes'))['votes__sum'] or 0,
+        )
+        for poll in Poll.objects.all()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0004_auto_20200302_1915'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollStatistics',
+            fields=[
+                ('poll', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='statistics', serialize=False, to='polls.Poll')),
+                ('participant_count', models.PositiveIntegerField(default=0)),
+                ('vote_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(compute_poll_statistics, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,11 @@
 from datetime import date, datetime
 
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
-from django.db.models import Sum
+from django.core.exceptions import ObjectDoesNotExist, SuspiciousOperation
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Sum
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
 from django.template import loader
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
@@ -28,7 +31,7 @@ class Poll(Document):
 
 	@property
 	def can_be_reverted(self):
-		return self.participants.count() == 0
+		return self.participant_count == 0
 
 	start_date = models.DateField(default=datetime.now, verbose_name=_("Start Date"))
 	end_date = models.DateField(default=datetime.now, verbose_name=_("End Date"))
@@ -47,11 +50,11 @@ class Poll(Document):
 
 	class LinkPattern(InternalLinkPattern):
 
-		def url(self, id):
-			poll = Poll.objects.get(id=id)
-			if poll:
-				return reverse(poll.get_view_url_name(), args=[poll.id])
-			return ''
+		def resolve(self, ids):
+			return {
+				poll.id: reverse(poll.get_view_url_name(), args=[poll.id])
+				for poll in Poll.objects.filter(id__in=ids)
+			}
 
 	@classmethod
 	def generate_new_title(cls):
@@ -73,10 +76,32 @@ class Poll(Document):
 			count += 1
 		return slug_final
 
+	@classmethod
+	def get_results_group_name(cls, poll_id):
+		return 'poll_results_{}'.format(poll_id)
+
 	@property
 	def vote_permission_name(self):
 		return Poll.get_vote_permission()
 
+	@property
+	def results_group_name(self):
+		return Poll.get_results_group_name(self.id)
+
+	@property
+	def results_are_visible(self):
+		today = date.today()
+		return self.start_date <= today and (self.show_results_immediately or self.end_date < today)
+
+	def results_can_be_seen_by(self, user):
+		"""
+			users that can still vote in the poll see the ballot instead of the results
+		"""
+		if not self.results_are_visible or not user.has_perm(Poll.get_view_permission(), self):
+			return False
+		can_vote = self.end_date >= date.today() and user.has_perm(Poll.get_vote_permission(), self)
+		return not can_vote or self.participants.filter(id=user.pk).exists()
+
 	def get_view_url(self):
 		return reverse(self.get_view_url_name(), args=(self.url_title,))
 
@@ -109,9 +134,42 @@ class Poll(Document):
 			choice.poll = self
 			choice.save()
 
+	def vote(self, user, choice_ids):
+		"""
+			counts the vote of the user for the given choices and records the participation in one transaction.
+			returns False if the user has voted already.
+		"""
+		choice_ids = set(choice_ids)
+		try:
+			with transaction.atomic():
+				# the participation is recorded first, so that concurrent votes of the same user fail here
+				Poll.participants.through.objects.create(poll=self, userprofile=user)
+				num_counted_choices = self.choices.filter(id__in=choice_ids).update(votes=F('votes') + 1)
+				if num_counted_choices != len(choice_ids):
+					raise SuspiciousOperation('Votes for choices of other polls are not allowed.')
+				num_updated_statistics = PollStatistics.objects.filter(poll=self).update(
+					participant_count=F('participant_count') + 1,
+					vote_count=F('vote_count') + len(choice_ids),
+				)
+				if num_updated_statistics == 0:
+					PollStatistics.update_for_polls([self.id])
+		except IntegrityError:
+			return False
+		return True
+
+	def get_statistics(self):
+		try:
+			return self.statistics
+		except ObjectDoesNotExist:
+			return PollStatistics.compute(self.id)
+
+	@property
+	def participant_count(self):
+		return self.get_statistics().participant_count
+
 	@property
 	def num_votes(self):
-		return self.choices.aggregate(Sum('votes')).get('votes__sum')
+		return self.get_statistics().vote_count
 
 	@property
 	def meta_information_html(self):
@@ -124,12 +182,9 @@ class Poll(Document):
 			assign_perm("{app}.view_{model}".format(app=content_type.app_label, model=content_type.model), group, self)
 			assign_perm("{app}.vote_{model}".format(app=content_type.app_label, model=content_type.model), group, self)
 
-	@property
-	def has_choice_descriptions(self):
-		for choice in self.choices.all():
-			if choice.description:
-				return True
-		return False
+	@staticmethod
+	def has_choice_descriptions(choices):
+		return any(choice.description for choice in choices)
 
 
 revisions.register(Poll, follow=["document_ptr"])
@@ -154,7 +209,86 @@ class Choice(models.Model):
 		return self.text_en
 
 	def percentage(self):
-		participant_count = self.poll.participants.count()
+		participant_count = self.poll.participant_count
 		if participant_count == 0:
 			return 0
 		return self.votes * 100 / participant_count
+
+
+class PollStatistics(models.Model):
+	"""
+		number of participants and votes of a poll, updated together with the votes
+		so that the results of a poll can be shown without counting all participants and votes
+	"""
+	poll = models.OneToOneField(Poll, primary_key=True, on_delete=models.CASCADE, related_name='statistics')
+	participant_count = models.PositiveIntegerField(default=0)
+	vote_count = models.PositiveIntegerField(default=0)
+
+	@classmethod
+	def compute(cls, poll_id):
+		return cls(
+			poll_id=poll_id,
+			participant_count=Poll.participants.through.objects.filter(poll_id=poll_id).count(),
+			vote_count=Choice.objects.filter(poll_id=poll_id).aggregate(Sum('votes'))['votes__sum'] or 0,
+		)
+
+	@classmethod
+	def update_for_polls(cls, poll_ids):
+		updated_statistics = []
+		for poll_id in poll_ids:
+			statistics = cls.compute(poll_id)
+			statistics, _ = cls.objects.update_or_create(poll_id=poll_id, defaults={
+				'participant_count': statistics.participant_count,
+				'vote_count': statistics.vote_count,
+			})
+			updated_statistics.append(statistics)
+		return updated_statistics
+
+	@classmethod
+	def update_for_poll(cls, poll):
+		# the statistics that might have been loaded with the poll are outdated now
+		poll.statistics, = cls.update_for_polls([poll.id])
+
+
+@receiver(post_save, sender=Poll, dispatch_uid="poll_saved")
+def create_poll_statistics(sender, instance, created, raw, **kwargs):
+	# votes only update existing statistics, so new polls get theirs right away
+	if created and not raw:
+		PollStatistics.objects.create(poll=instance)
+
+
+@receiver(m2m_changed, sender=Poll.participants.through, dispatch_uid="poll_participants_changed")
+def update_poll_statistics_on_participants_change(sender, instance, action, reverse, pk_set, **kwargs):
+	if reverse and action == 'pre_clear':
+		instance._cleared_poll_ids = list(instance.polls.values_list('id', flat=True))
+	if action not in ('post_add', 'post_remove', 'post_clear'):
+		return
+
+	if not reverse:
+		PollStatistics.update_for_poll(instance)
+	elif action == 'post_clear':
+		PollStatistics.update_for_polls(instance._cleared_poll_ids)
+	else:
+		PollStatistics.update_for_polls(pk_set)
+
+
+@receiver(post_save, sender=Choice, dispatch_uid="poll_choice_saved")
+@receiver(post_delete, sender=Choice, dispatch_uid="poll_choice_deleted")
+def update_poll_statistics_on_choice_change(sender, instance, raw=False, **kwargs):
+	if raw:
+		return
+
+	if Choice.poll.is_cached(instance):
+		PollStatistics.update_for_poll(instance.poll)
+	else:
+		PollStatistics.update_for_polls([instance.poll_id])
+
+
+@receiver(pre_delete, sender=UserProfile, dispatch_uid="poll_participant_deleting")
+def remember_polls_of_deleted_user(sender, instance, **kwargs):
+	instance._participated_poll_ids = list(instance.polls.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=UserProfile, dispatch_uid="poll_participant_deleted")
+def update_poll_statistics_on_user_delete(sender, instance, **kwargs):
+	PollStatistics.update_for_polls(getattr(instance, '_participated_poll_ids', []))
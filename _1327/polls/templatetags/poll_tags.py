@@ -7,10 +7,7 @@ register = template.Library()
 
 @register.filter
 def can_see_results(poll):
-	if not poll.show_results_immediately and poll.end_date >= datetime.date.today():
-		return False
-	else:
-		return True
+	return poll.results_are_visible
 
 
 @register.filter
@@ -1,9 +1,19 @@
 import datetime
-
-from django.contrib.auth.models import Group
-from django.db import transaction
+import json
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+import channels.layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, Group
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousOperation
+from django.db import connection, transaction
 from django.template.defaultfilters import floatformat
-from django.test import TestCase
+from django.test import override_settings, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django_webtest import WebTest
 from guardian.shortcuts import assign_perm, get_perms
@@ -12,7 +22,10 @@ from model_bakery import baker
 from reversion import revisions
 from reversion.models import Version
 
-from _1327.polls.models import Choice, Poll
+from _1327.polls.live_results import broadcast_results, get_broadcast_key, get_results_message, schedule_results_broadcast
+from _1327.polls.models import Choice, Poll, PollStatistics
+from _1327.routing import websocket_urlpatterns
+from _1327.user_management.middleware import IPRangeUserWebsocketMiddleware
 from _1327.user_management.models import UserProfile
 
 
@@ -42,6 +55,131 @@ class PollModelTests(TestCase):
 		for choice in poll.choices.all():
 			self.assertAlmostEqual(choice.percentage(), expected_percentage, 2)
 
+	def test_vote(self):
+		user = baker.make(UserProfile)
+		poll = baker.make(Poll)
+		choices = baker.make(Choice, poll=poll, _quantity=3, votes=0)
+
+		with self.assertNumQueries(5):
+			self.assertTrue(poll.vote(user, [choices[0].id, choices[2].id]))
+		self.assertEqual([choice.votes for choice in poll.choices.order_by('id')], [1, 0, 1])
+		self.assertEqual(list(poll.participants.all()), [user])
+
+		statistics = PollStatistics.objects.get(poll=poll)
+		self.assertEqual(statistics.participant_count, 1)
+		self.assertEqual(statistics.vote_count, 2)
+
+		# a user can only vote once
+		self.assertFalse(poll.vote(user, [choices[1].id]))
+		self.assertEqual([choice.votes for choice in poll.choices.order_by('id')], [1, 0, 1])
+		self.assertEqual(PollStatistics.objects.get(poll=poll).vote_count, 2)
+
+	def test_statistics_are_updated(self):
+		users = baker.make(UserProfile, _quantity=3)
+		poll = baker.make(Poll, participants=users)
+		choices = baker.make(Choice, poll=poll, _quantity=2, votes=2)
+		self.assertEqual(poll.participant_count, 3)
+		self.assertEqual(poll.num_votes, 4)
+
+		poll.participants.remove(users[0])
+		choices[0].delete()
+		users[1].delete()
+		poll = Poll.objects.get()
+		self.assertEqual(poll.participant_count, 1)
+		self.assertEqual(poll.num_votes, 2)
+
+		# polls without statistics fall back to counting
+		PollStatistics.objects.all().delete()
+		poll = Poll.objects.get()
+		self.assertEqual(poll.participant_count, 1)
+		self.assertEqual(poll.num_votes, 2)
+
+	def test_vote_for_choice_of_other_poll(self):
+		user = baker.make(UserProfile)
+		poll = baker.make(Poll)
+		choice = baker.make(Choice, poll=poll, votes=0)
+		other_choice = baker.make(Choice, votes=0)
+
+		with self.assertRaises(SuspiciousOperation):
+			poll.vote(user, [choice.id, other_choice.id])
+		choice.refresh_from_db()
+		self.assertEqual(choice.votes, 0)
+		self.assertEqual(poll.participants.count(), 0)
+
+
+class PollLiveResultsTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.poll = baker.make(Poll, participants=baker.make(UserProfile, _quantity=4))
+		cls.choices = [baker.make(Choice, poll=cls.poll, votes=votes) for votes in [3, 1]]
+
+	def setUp(self):
+		cache.delete(get_broadcast_key(self.poll.id))
+
+	def test_results_message(self):
+		results = json.loads(get_results_message(self.poll.id))
+		self.assertEqual(results['participant_count'], 4)
+		self.assertEqual(results['vote_count'], 4)
+		self.assertEqual(results['choices'], [
+			{'id': self.choices[0].id, 'votes': 3, 'percentage': 75},
+			{'id': self.choices[1].id, 'votes': 1, 'percentage': 25},
+		])
+
+	def test_broadcast_results(self):
+		channel_layer = channels.layers.get_channel_layer()
+		channel_name = async_to_sync(channel_layer.new_channel)()
+		async_to_sync(channel_layer.group_add)(self.poll.results_group_name, channel_name)
+
+		broadcast_results(self.poll.id)
+		message = async_to_sync(channel_layer.receive)(channel_name)
+		self.assertEqual(message['type'], 'update_results')
+		self.assertEqual(message['message'], get_results_message(self.poll.id))
+
+		async_to_sync(channel_layer.group_discard)(self.poll.results_group_name, channel_name)
+
+	def test_broadcasts_are_coalesced(self):
+		with patch('_1327.polls.live_results.threading.Timer') as timer:
+			for __ in range(3):
+				schedule_results_broadcast(self.poll.id)
+			self.assertEqual(timer.call_count, 1)
+
+			# votes after the broadcast are sent with the next one
+			broadcast_results(self.poll.id)
+			schedule_results_broadcast(self.poll.id)
+			self.assertEqual(timer.call_count, 2)
+
+		cache.delete(get_broadcast_key(self.poll.id))
+
+
+@override_settings(ANONYMOUS_IP_RANGE_GROUPS={'8.0.0.0/8': 'university_group'})
+class PollResultsConsumerTests(TransactionTestCase):
+
+	def setUp(self):
+		self.poll = baker.make(Poll, start_date=datetime.date.today(), end_date=datetime.date.today() - datetime.timedelta(days=1))
+		university_group = baker.make(Group, name='university_group')
+		assign_perm(self.poll.view_permission_name, university_group, self.poll)
+
+	def connect(self, client_address):
+		async def connect():
+			communicator = WebsocketCommunicator(
+				IPRangeUserWebsocketMiddleware(URLRouter(websocket_urlpatterns)),
+				'{}/{}'.format(settings.POLL_RESULTS_URL, self.poll.id),
+			)
+			communicator.scope['user'] = AnonymousUser()
+			communicator.scope['client'] = (client_address, 50000)
+			connected, __ = await communicator.connect()
+			await communicator.disconnect()
+			return connected
+
+		return async_to_sync(connect)()
+
+	def test_university_network_can_see_results(self):
+		self.assertTrue(self.connect('8.0.0.1'))
+
+	def test_other_networks_can_not_see_results(self):
+		self.assertFalse(self.connect('9.0.0.1'))
+
 
 class PollViewTests(WebTest):
 	csrf_checks = False
@@ -112,6 +250,29 @@ class PollViewTests(WebTest):
 		self.assertIn(b"There are no polls you can vote for.", response.body)
 		self.assertIn(b"There are no results you can see.", response.body)
 
+	def test_index_queries_do_not_depend_on_number_of_polls(self):
+		user = baker.make(UserProfile)
+		user.groups.add(self.group)
+
+		def count_index_queries():
+			# the first request fills the caches
+			self.app.get(reverse('polls:index'), user=user)
+			with CaptureQueriesContext(connection) as context:
+				response = self.app.get(reverse('polls:index'), user=user)
+			self.assertEqual(response.status_code, 200)
+			return len(context.captured_queries)
+
+		num_queries = count_index_queries()
+		for days in range(-2, 3):
+			poll = baker.make(
+				Poll,
+				start_date=datetime.date.today() + datetime.timedelta(days=days),
+				end_date=datetime.date.today() + datetime.timedelta(days=days + 1),
+			)
+			poll.set_all_permissions(self.group)
+		self.poll.participants.add(user)
+		self.assertEqual(count_index_queries(), num_queries)
+
 	def test_create_poll(self):
 		response = self.app.get(reverse('documents:create', args=['poll']), user=self.user)
 		self.assertEqual(response.status_code, 200)
@@ -1,9 +1,11 @@
 import datetime
 
 
+from django.conf import settings
 from django.contrib import messages
-from django.core.exceptions import PermissionDenied
-from django.db.models import F
+from django.core.exceptions import PermissionDenied, SuspiciousOperation
+from django.db import transaction
+from django.db.models import BooleanField, Case, Exists, OuterRef, Value, When
 from django.http import Http404, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
@@ -11,25 +13,37 @@ from django.utils.translation import gettext_lazy as _
 
 from _1327.documents.models import Document
 from _1327.main.utils import convert_markdown, document_permission_overview
+from _1327.polls.live_results import schedule_results_broadcast
 from _1327.polls.models import Poll
 from _1327.user_management.shortcuts import check_permissions
 
 
 def index(request):
+	today = datetime.date.today()
+	polls = Poll.objects.annotate(
+		is_upcoming=Case(When(start_date__gt=today, then=Value(True)), default=Value(False), output_field=BooleanField()),
+		is_open=Case(When(end_date__gte=today, then=Value(True)), default=Value(False), output_field=BooleanField()),
+		participated=Exists(Poll.participants.through.objects.filter(poll=OuterRef('pk'), userprofile_id=request.user.pk)),
+	).order_by('-end_date')
+	polls = list(polls)
+
+	# all permission checks below are answered from the prefetched permissions
+	request.permission_checker.prefetch(polls)
+	editable_poll_ids = {poll.id for poll in polls if request.user.has_perm("polls.change_poll", obj=poll)}
+
 	running_polls = []
 	finished_polls = []
 	upcoming_polls = []
 	# do not show polls that a user is not allowed to see
-	for poll in Poll.objects.all().order_by('-end_date'):
-		if request.user.has_perm(Poll.get_view_permission(), obj=poll) and poll.start_date <= datetime.date.today():
-			if datetime.date.today() <= poll.end_date \
-						and not poll.participants.filter(id=request.user.pk).exists() \
-						and request.user.has_perm(Poll.get_vote_permission(), poll):
+	for poll in polls:
+		if poll.is_upcoming:
+			if poll.id in editable_poll_ids:
+				upcoming_polls.append(poll)
+		elif request.user.has_perm(Poll.get_view_permission(), obj=poll):
+			if poll.is_open and not poll.participated and request.user.has_perm(Poll.get_vote_permission(), poll):
 				running_polls.append(poll)
 			else:
 				finished_polls.append(poll)
-		elif request.user.has_perm("polls.change_poll", obj=poll) and poll.start_date > datetime.date.today():
-			upcoming_polls.append(poll)
 
 	return render(
 		request,
@@ -38,6 +52,7 @@ def index(request):
 			"running_polls": running_polls,
 			"finished_polls": finished_polls,
 			"upcoming_polls": upcoming_polls,
+			"editable_poll_ids": editable_poll_ids,
 		}
 	)
 
@@ -62,6 +77,7 @@ def results(request, poll, url_title):
 		return HttpResponseRedirect(reverse('polls:index'))
 
 	description, toc = convert_markdown(poll.text)
+	choices = list(poll.choices.all())
 
 	return render(
 		request,
@@ -74,7 +90,9 @@ def results(request, poll, url_title):
 			'view_page': True,
 			'attachments': poll.attachments.filter(no_direct_download=False).order_by('index'),
 			'permission_overview': document_permission_overview(request.user, poll),
-			"has_choice_descriptions": poll.has_choice_descriptions,
+			"choices": choices,
+			"has_choice_descriptions": Poll.has_choice_descriptions(choices),
+			"poll_results_url": settings.POLL_RESULTS_URL,
 		}
 	)
 
@@ -85,6 +103,7 @@ def results_for_admin(request, title):
 
 	poll = get_object_or_404(Document, url_title=title)
 	description, toc = convert_markdown(poll.text)
+	choices = list(poll.choices.all())
 
 	return render(
 		request,
@@ -97,7 +116,8 @@ def results_for_admin(request, title):
 			'view_page': True,
 			'attachments': poll.attachments.filter(no_direct_download=False).order_by('index'),
 			'permission_overview': document_permission_overview(request.user, poll),
-			"has_choice_descriptions": poll.has_choice_descriptions,
+			"choices": choices,
+			"has_choice_descriptions": Poll.has_choice_descriptions(choices),
 			"is_preview": True,
 		}
 	)
@@ -120,11 +140,14 @@ def vote(request, poll, url_title):
 			messages.error(request, _("You can only select up to {} options!").format(poll.max_allowed_number_of_answers))
 			return HttpResponseRedirect(reverse(poll.get_view_url_name(), args=[url_title]))
 
-		for choice_id in choices:
-			choice = poll.choices.filter(id=choice_id)
-			choice.update(votes=F('votes') + 1)
+		try:
+			choice_ids = [int(choice_id) for choice_id in choices]
+		except ValueError:
+			raise SuspiciousOperation('Invalid choice.')
+		if not poll.vote(request.user, choice_ids):
+			return results(request, poll, url_title)
+		transaction.on_commit(lambda: schedule_results_broadcast(poll.id))
 
-		poll.participants.add(request.user)
 		messages.success(request, _("We've received your vote!"))
 		if not poll.show_results_immediately:
 			messages.info(request, _("The results of this poll will be available as from {}").format((poll.end_date + datetime.timedelta(days=1)).strftime("%d. %B %Y")))
@@ -132,6 +155,7 @@ def vote(request, poll, url_title):
 		return HttpResponseRedirect(reverse(poll.get_view_url_name(), args=[url_title]))
 
 	description, toc = convert_markdown(poll.text)
+	choices = list(poll.choices.all())
 
 	return render(
 		request,
@@ -145,7 +169,8 @@ def vote(request, poll, url_title):
 			"widget": "checkbox" if poll.max_allowed_number_of_answers != 1 else "radio",
 			'attachments': poll.attachments.filter(no_direct_download=False).order_by('index'),
 			'permission_overview': document_permission_overview(request.user, poll),
-			"has_choice_descriptions": poll.has_choice_descriptions,
+			"choices": choices,
+			"has_choice_descriptions": Poll.has_choice_descriptions(choices),
 		}
 	)
 
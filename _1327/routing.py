@@ -5,18 +5,23 @@ from django.core.asgi import get_asgi_application
 from django.urls import path
 
 from _1327.documents.consumers import PreviewConsumer
+from _1327.polls.consumers import PollResultsConsumer
+from _1327.user_management.middleware import IPRangeUserWebsocketMiddleware
 
 
 websocket_urlpatterns = [
 	path("{preview_url}/<hash_value>".format(preview_url=settings.PREVIEW_URL.lstrip('/')), PreviewConsumer.as_asgi()),
+	path("{poll_results_url}/<int:poll_id>".format(poll_results_url=settings.POLL_RESULTS_URL.lstrip('/')), PollResultsConsumer.as_asgi()),
 ]
 
 
 application = ProtocolTypeRouter({
 	'http': get_asgi_application(),
 	'websocket': AuthMiddlewareStack(
-		URLRouter(
-			websocket_urlpatterns
+		IPRangeUserWebsocketMiddleware(
+			URLRouter(
+				websocket_urlpatterns
+			)
 		)
 	)
 })
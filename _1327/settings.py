@@ -45,6 +45,35 @@ ADMINS = [
 
 DELETE_EMPTY_PAGE_AFTER = timedelta(hours=1)
 
+MINUTES_PER_PAGE = 50
+MINUTES_SEARCH_LINES_PER_DOCUMENT = 10
+VERSIONS_PER_PAGE = 50
+
+# Rendered markdown is cached for this many seconds. The cache is invalidated when abbreviations or link targets change.
+MARKDOWN_CACHE_TIMEOUT = timedelta(days=7).total_seconds()
+
+# Object permissions of the anonymous user and the IP range groups are cached for this many seconds.
+# The cache is invalidated whenever permissions change. They are not cached at all if CACHES uses a local-memory cache.
+OBJECT_PERMISSION_CACHE_TIMEOUT = timedelta(days=1).total_seconds()
+
+# The menu visible for a user is cached for this many seconds.
+# Changes of the menu items or of the permissions result in a new cache key.
+MENU_CACHE_TIMEOUT = timedelta(days=1).total_seconds()
+
+# The latest rendering of a live preview is kept for this many seconds, new watchers of the preview start with it.
+PREVIEW_STATE_TIMEOUT = timedelta(hours=1).total_seconds()
+
+# Previews that are sent over websockets are rendered in this many threads per process.
+PREVIEW_RENDER_THREADS = 4
+
+# If enabled, the texts of document versions are stored as compressed changes to the previous version instead of full copies.
+# Every REVISION_SNAPSHOT_INTERVAL-th version keeps its full texts, so at most that many versions are read to reconstruct a version.
+COMPRESS_REVISION_TEXTS = False
+REVISION_SNAPSHOT_INTERVAL = 20
+
+# Viewers of poll results get the new results at most once in this many seconds while votes are coming in.
+POLL_RESULTS_BROADCAST_INTERVAL = 2
+
 FORBIDDEN_URLS = [
 	"abbreviation_explanation", "admin", "attachment", "attachments", "autosave", "change", "create", "delete",
 	"delete-cascade", "documents", "download", "edit", "get", "hijack", "information_pages", "list", "login", "logout",
@@ -126,6 +155,7 @@ MIDDLEWARE = [
 	'django.middleware.csrf.CsrfViewMiddleware',
 	'django.contrib.auth.middleware.AuthenticationMiddleware',
 	'_1327.user_management.middleware.IPRangeUserMiddleware',
+	'_1327.user_management.middleware.PermissionCheckerMiddleware',
 	'django.contrib.messages.middleware.MessageMiddleware',
 	'django.middleware.clickjacking.XFrameOptionsMiddleware',
 	'django.middleware.locale.LocaleMiddleware',
@@ -135,11 +165,14 @@ MIDDLEWARE = [
 
 AUTHENTICATION_BACKENDS = [
 	'django.contrib.auth.backends.ModelBackend',
-	'guardian.backends.ObjectPermissionBackend',
+	'_1327.user_management.authentication.ObjectPermissionBackend',
 	'_1327.user_management.authentication.OpenIDAuthenticationBackend',
 	'_1327.user_management.authentication._1327AuthorizationBackend',
 ]
 
+# the object permission backend of guardian is replaced by a subclass, which guardian's check does not recognize
+SILENCED_SYSTEM_CHECKS = ['guardian.W001']
+
 # needed by django-guardian library
 ANONYMOUS_USER_ID = -1
 GUARDIAN_RAISE_403 = True
@@ -182,7 +215,21 @@ CHANNEL_LAYERS = {
 	}
 }
 
+# All processes have to use the same cache. Rendered markdown, menus and the object permissions of the anonymous user
+# and the IP range groups are invalidated by incrementing counters in it, and broadcasts of poll results are coalesced
+# with it. A local-memory cache is only correct if a single process serves the site.
+CACHES = {
+	'default': {
+		'BACKEND': 'django_redis.cache.RedisCache',
+		'LOCATION': 'redis://127.0.0.1:6379/1',
+		'OPTIONS': {
+			'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+		}
+	}
+}
+
 PREVIEW_URL = '/ws/preview'
+POLL_RESULTS_URL = '/ws/poll-results'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 EMAIL_HOST = ''
@@ -272,10 +319,7 @@ TEMPLATES = [
 				'django.template.context_processors.tz',
 				'django.contrib.messages.context_processors.messages',
 				'_1327.main.context_processors.menu',
-				'_1327.main.context_processors.can_create_informationpage',
-				'_1327.main.context_processors.can_create_minutes',
-				'_1327.main.context_processors.can_create_poll',
-				'_1327.main.context_processors.can_change_menu_items',
+				'_1327.main.context_processors.capabilities',
 				'_1327.main.context_processors.image_paths',
 			],
 		},
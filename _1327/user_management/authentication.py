@@ -1,17 +1,39 @@
 import unicodedata
 
 from django.contrib.auth import user_logged_in
-from django.contrib.auth.models import Group
 from django.contrib.contenttypes.models import ContentType
 from django.dispatch import receiver
 from django.utils import translation
 from django.utils.translation import get_language, LANGUAGE_SESSION_KEY
-from guardian.core import ObjectPermissionChecker
-from guardian.utils import get_anonymous_user
+from guardian import backends as guardian_backends
+from guardian.ctypes import get_content_type
+from guardian.exceptions import WrongAppError
 from mozilla_django_oidc.auth import OIDCAuthenticationBackend
 
 from _1327.main.utils import clean_email
 from _1327.user_management.models import UserProfile
+from _1327.user_management.permissions import get_anonymous_user_checker, get_ip_range_group_checker
+
+
+class ObjectPermissionBackend(guardian_backends.ObjectPermissionBackend):
+	"""
+		uses the permission checker of the current request if there is one, see PermissionCheckerMiddleware
+	"""
+
+	def has_perm(self, user_obj, perm, obj=None):
+		permission_checker = getattr(user_obj, '_permission_checker', None)
+		if permission_checker is None:
+			return super().has_perm(user_obj, perm, obj)
+
+		# the same checks as in guardian's has_perm, before the request's checker answers instead of a new one
+		support, __ = guardian_backends.check_support(user_obj, obj)
+		if not support:
+			return False
+		if '.' in perm:
+			app_label, __ = perm.split('.', 1)
+			if app_label != obj._meta.app_label and app_label != get_content_type(obj).app_label:
+				raise WrongAppError("Passed perm has app label of '{}' while given obj has app label '{}'".format(app_label, obj._meta.app_label))
+		return permission_checker.get_user_checker().has_perm(perm, obj)
 
 
 class _1327AuthorizationBackend:
@@ -30,17 +52,23 @@ class _1327AuthorizationBackend:
 		if app != content_type.app_label:
 			return False
 
+		permission_checker = getattr(user_obj, '_permission_checker', None)
 		group_name = user_obj._ip_range_group_name if hasattr(user_obj, '_ip_range_group_name') else None
 
 		if user_obj.is_authenticated:
 			# user is not anonymous user and no other backend confirmed the permission yet
 			# --> we need to check the anonymous permissions again
-			check = ObjectPermissionChecker(get_anonymous_user())
+			if permission_checker is not None:
+				check = permission_checker.get_anonymous_user_checker()
+			else:
+				check = get_anonymous_user_checker()
 			if check.has_perm(perm, obj):
 				return True
 		if group_name:
-			group = Group.objects.get(name=group_name)
-			check = ObjectPermissionChecker(group)
+			if permission_checker is not None:
+				check = permission_checker.get_ip_range_group_checker()
+			else:
+				check = get_ip_range_group_checker(group_name)
 			return check.has_perm(perm, obj)
 		return False
 
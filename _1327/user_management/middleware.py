@@ -1,20 +1,35 @@
 from ipaddress import ip_address, ip_network
 from urllib.parse import urlparse
 
+from channels.middleware import BaseMiddleware
 from django.conf import settings
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.core.exceptions import ImproperlyConfigured, PermissionDenied
 from django.shortcuts import resolve_url
 
+from _1327.user_management.permissions import RequestPermissionChecker
+
+
+def get_ip_ranges():
+	try:
+		return {ip_network(k): v for k, v in settings.ANONYMOUS_IP_RANGE_GROUPS.items()}
+	except ValueError as e:
+		raise ImproperlyConfigured from e
+
+
+def get_ip_range_group_name(ip_ranges, address):
+	address = ip_address(address)
+	for ip_range, group_name in ip_ranges.items():
+		if address in ip_range:
+			return group_name
+	return None
+
 
 class IPRangeUserMiddleware:
 
 	def __init__(self, get_response):
 		self.get_response = get_response
-		try:
-			self.ip_ranges = {ip_network(k): v for k, v in settings.ANONYMOUS_IP_RANGE_GROUPS.items()}
-		except ValueError as e:
-			raise ImproperlyConfigured from e
+		self.ip_ranges = get_ip_ranges()
 
 	def __call__(self, request):
 		self.process_request(request)
@@ -23,12 +38,40 @@ class IPRangeUserMiddleware:
 
 	def process_request(self, request):
 		if request.user.is_anonymous:
-			address = ip_address(request.META.get('REMOTE_ADDR'))
-			for ip_range, group_name in self.ip_ranges.items():
-				if address in ip_range:
-					# user is in this IP range
-					request.user._ip_range_group_name = group_name
-					break
+			group_name = get_ip_range_group_name(self.ip_ranges, request.META.get('REMOTE_ADDR'))
+			if group_name is not None:
+				# user is in this IP range
+				request.user._ip_range_group_name = group_name
+
+
+class IPRangeUserWebsocketMiddleware(BaseMiddleware):
+	"""
+		does the same as IPRangeUserMiddleware for websocket connections, needs to be wrapped by the AuthMiddleware
+	"""
+
+	async def __call__(self, scope, receive, send):
+		user = scope.get('user')
+		client = scope.get('client')
+		if user is not None and client is not None and user.is_anonymous:
+			group_name = get_ip_range_group_name(get_ip_ranges(), client[0])
+			if group_name is not None:
+				user._ip_range_group_name = group_name
+		return await super().__call__(scope, receive, send)
+
+
+class PermissionCheckerMiddleware:
+	"""
+		attaches a RequestPermissionChecker to the request and its user, so that all object permission checks of a
+		request share the permissions loaded from the database
+	"""
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def __call__(self, request):
+		request.permission_checker = RequestPermissionChecker(request.user)
+		request.user._permission_checker = request.permission_checker
+		return self.get_response(request)
 
 
 class LoginRedirectMiddleware:
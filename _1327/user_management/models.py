@@ -1,13 +1,15 @@
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, Group, PermissionsMixin
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
+from guardian.models import GroupObjectPermission, UserObjectPermission
 
 from _1327.main.utils import clean_email
+from _1327.user_management.permissions import bump_permission_generation
 
 
 class UserManager(BaseUserManager):
@@ -88,3 +90,21 @@ def add_to_default_group(sender, **kwargs):
 		user = kwargs.get('instance')
 		group, __ = Group.objects.get_or_create(name=settings.DEFAULT_USER_GROUP_NAME)
 		user.groups.add(group)
+
+
+@receiver(post_save, sender=UserObjectPermission, dispatch_uid="user_permission_saved")
+@receiver(post_delete, sender=UserObjectPermission, dispatch_uid="user_permission_deleted")
+@receiver(post_save, sender=GroupObjectPermission, dispatch_uid="group_permission_saved")
+@receiver(post_delete, sender=GroupObjectPermission, dispatch_uid="group_permission_deleted")
+@receiver(m2m_changed, sender=UserProfile.groups.through, dispatch_uid="user_groups_changed")
+@receiver(m2m_changed, sender=UserProfile.user_permissions.through, dispatch_uid="user_permissions_changed")
+@receiver(m2m_changed, sender=Group.permissions.through, dispatch_uid="group_permissions_changed")
+def invalidate_permission_checkers(sender, **kwargs):
+	bump_permission_generation()
+
+
+@receiver(post_save, sender=Group, dispatch_uid="group_saved")
+def invalidate_permission_checkers_on_group_change(sender, instance, created, **kwargs):
+	# the permissions of ip range groups are cached by the group name
+	if not created:
+		bump_permission_generation()
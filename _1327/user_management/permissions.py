@@ -0,0 +1,176 @@
+from collections import defaultdict
+import hashlib
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from guardian.core import ObjectPermissionChecker
+from guardian.models import GroupObjectPermission, UserObjectPermission
+from guardian.utils import get_anonymous_user
+
+from _1327.main.utils import bump_cache_generation, cache_is_shared, get_cache_generation
+
+
+# Incremented whenever object permissions or group memberships change in this process.
+# Request permission checkers drop everything they loaded for an older generation.
+_permission_generation = 0
+
+# object permissions of the anonymous user and the ip range groups, shared by all requests of this process.
+# they are only shared if the cache is shared by all processes as well, see cache_is_shared
+_shared_object_permissions = {}
+
+# shared object permissions are cached for the generation stored at this key and are invalid once it changes
+SHARED_PERMISSION_GENERATION_KEY = 'object_permission_generation'
+
+
+def get_shared_permission_generation():
+	return get_cache_generation(SHARED_PERMISSION_GENERATION_KEY)
+
+
+def bump_shared_permission_generation():
+	bump_cache_generation(SHARED_PERMISSION_GENERATION_KEY)
+
+
+def bump_permission_generation():
+	"""
+		invalidates all loaded object permissions. this happens automatically for changes that send signals,
+		changes that don't (e.g. guardian's bulk_assign_perm or queryset updates) have to call it explicitly.
+	"""
+	global _permission_generation
+	_permission_generation += 1
+	# other transactions only see the change once it is committed, nothing needs to be invalidated after a rollback
+	transaction.on_commit(bump_shared_permission_generation)
+
+
+def has_pending_permission_changes():
+	"""
+		whether the current transaction changed permissions that are not committed yet,
+		permissions loaded until then must not be shared with other transactions
+	"""
+	connection = transaction.get_connection()
+	return connection.in_atomic_block and any(func is bump_shared_permission_generation for __, func in connection.run_on_commit)
+
+
+def load_object_permissions(*querysets):
+	"""
+		loads the given user or group object permissions,
+		mapping (content type id, object pk) to a set of permission codenames
+	"""
+	permissions = defaultdict(set)
+	for queryset in querysets:
+		for content_type_id, object_pk, codename in queryset.values_list('content_type_id', 'object_pk', 'permission__codename'):
+			permissions[(content_type_id, object_pk)].add(codename)
+	return dict(permissions)
+
+
+def load_user_object_permissions(user):
+	return load_object_permissions(
+		UserObjectPermission.objects.filter(user=user),
+		GroupObjectPermission.objects.filter(group__user=user),
+	)
+
+
+def get_shared_object_permissions(key, load_permissions):
+	# other processes would not notice the changes of permissions in a local-memory cache
+	if not cache_is_shared() or has_pending_permission_changes():
+		return load_permissions()
+
+	generation = get_shared_permission_generation()
+	entry = _shared_object_permissions.get(key)
+	if entry is not None and entry[0] == generation:
+		return entry[1]
+
+	cache_key = 'object_permissions_{}_{}'.format(generation, key)
+	permissions = cache.get(cache_key)
+	if permissions is None:
+		permissions = load_permissions()
+		cache.set(cache_key, permissions, settings.OBJECT_PERMISSION_CACHE_TIMEOUT)
+	_shared_object_permissions[key] = (generation, permissions)
+	return permissions
+
+
+class SharedObjectPermissionChecker:
+	"""
+		checks the object permissions of a user or group that are loaded completely and shared between requests,
+		offers the same interface as guardian's ObjectPermissionChecker
+	"""
+
+	def __init__(self, permissions):
+		self.permissions = permissions
+
+	def has_perm(self, perm, obj):
+		if '.' in perm:
+			__, perm = perm.split('.', 1)
+		key = (ContentType.objects.get_for_model(obj).id, str(obj.pk))
+		return perm in self.permissions.get(key, ())
+
+	def prefetch_perms(self, objects):
+		# all permissions are loaded already
+		pass
+
+
+def get_anonymous_user_checker():
+	return SharedObjectPermissionChecker(get_shared_object_permissions(
+		'anonymous_user',
+		lambda: load_user_object_permissions(get_anonymous_user()),
+	))
+
+
+def get_ip_range_group_checker(group_name):
+	key = 'group_{}'.format(hashlib.md5(group_name.encode()).hexdigest())
+	return SharedObjectPermissionChecker(get_shared_object_permissions(
+		key,
+		lambda: load_object_permissions(GroupObjectPermission.objects.filter(group__name=group_name)),
+	))
+
+
+class RequestPermissionChecker:
+	"""
+		Answers the object permission checks for the user of a single request.
+
+		The object permissions of the user (including its groups) are loaded at most once per object and kept in
+		memory. Use prefetch() to load them for many objects with a single query per model. The permissions of the
+		anonymous user and of the ip range group of the user are shared by all requests.
+	"""
+
+	def __init__(self, user):
+		self.user = user
+		self.generation = _permission_generation
+		self.checkers = {}
+
+	def _get_checker(self, key, create_checker):
+		if self.generation != _permission_generation:
+			self.generation = _permission_generation
+			self.checkers = {}
+		if key not in self.checkers:
+			self.checkers[key] = create_checker()
+		return self.checkers[key]
+
+	def get_user_checker(self):
+		if not self.user.is_authenticated:
+			return self.get_anonymous_user_checker()
+		return self._get_checker('user', lambda: ObjectPermissionChecker(self.user))
+
+	def get_anonymous_user_checker(self):
+		return self._get_checker('anonymous_user', get_anonymous_user_checker)
+
+	def get_ip_range_group_checker(self):
+		group_name = getattr(self.user, '_ip_range_group_name', None)
+		if group_name is None:
+			return None
+		return self._get_checker('ip_range_group', lambda: get_ip_range_group_checker(group_name))
+
+	def prefetch(self, objects):
+		# the permissions of the anonymous user and the ip range group are always loaded completely
+		self.get_anonymous_user_checker()
+		self.get_ip_range_group_checker()
+		if not self.user.is_authenticated:
+			return
+
+		# permissions can only be prefetched for objects of the same model at once
+		objects_by_model = defaultdict(list)
+		for obj in objects:
+			objects_by_model[type(obj)].append(obj)
+		for model_objects in objects_by_model.values():
+			self.get_user_checker().prefetch_perms(model_objects)
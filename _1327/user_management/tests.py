@@ -1,15 +1,22 @@
+from unittest.mock import patch
+
 from django.conf import settings
 from django.contrib.auth.models import Group, Permission
+from django.db import DatabaseError, transaction
+from django.test import TestCase, TransactionTestCase
 from django.test.utils import override_settings
 from django.urls import reverse
 
 from django_webtest import WebTest
-from guardian.shortcuts import assign_perm
+from guardian.exceptions import WrongAppError
+from guardian.models import GroupObjectPermission
+from guardian.shortcuts import assign_perm, remove_perm
 from guardian.utils import get_anonymous_user
 from model_bakery import baker
 
 from _1327.information_pages.models import InformationDocument
 from .models import UserProfile
+from .permissions import bump_permission_generation, get_anonymous_user_checker, get_ip_range_group_checker, RequestPermissionChecker
 
 
 class UsecaseTests(WebTest):
@@ -278,6 +285,115 @@ class _1327AuthenticationBackendUniversityNetworkTests(WebTest):
 		self.assertRedirects(response, redirect_url)
 
 
+class RequestPermissionCheckerTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.documents = baker.make(InformationDocument, _quantity=3)
+		cls.user = baker.make(UserProfile)
+		cls.group = baker.make(Group)
+		cls.user.groups.add(cls.group)
+
+	def test_prefetched_permissions_are_answered_from_memory(self):
+		assign_perm(self.documents[0].view_permission_name, self.user, self.documents[0])
+		assign_perm(self.documents[1].view_permission_name, self.group, self.documents[1])
+		assign_perm(self.documents[2].view_permission_name, get_anonymous_user(), self.documents[2])
+
+		self.user._permission_checker = RequestPermissionChecker(self.user)
+		self.user._permission_checker.prefetch(self.documents)
+		with self.assertNumQueries(0):
+			for document in self.documents:
+				self.assertTrue(self.user.has_perm(document.view_permission_name, document))
+				self.assertFalse(self.user.has_perm(document.edit_permission_name, document))
+
+	def test_permissions_of_other_apps_are_rejected(self):
+		document = self.documents[0]
+		assign_perm(document.view_permission_name, self.user, document)
+		self.user._permission_checker = RequestPermissionChecker(self.user)
+		with self.assertRaises(WrongAppError):
+			self.user.has_perm('polls.' + document.view_permission_name.split('.')[1], document)
+
+	def test_permission_changes_invalidate_checker(self):
+		document = self.documents[0]
+		self.user._permission_checker = RequestPermissionChecker(self.user)
+		self.assertFalse(self.user.has_perm(document.view_permission_name, document))
+
+		assign_perm(document.view_permission_name, self.group, document)
+		self.assertTrue(self.user.has_perm(document.view_permission_name, document))
+
+		remove_perm(document.view_permission_name, self.group, document)
+		self.assertFalse(self.user.has_perm(document.view_permission_name, document))
+
+
+class SharedObjectPermissionTests(TransactionTestCase):
+	"""
+		permissions are only shared once they are committed, so the changes in these tests are committed
+	"""
+
+	def setUp(self):
+		self.document = baker.make(InformationDocument)
+		self.user = baker.make(UserProfile)
+		self.group = baker.make(Group)
+		self.user.groups.add(self.group)
+		# the tests might use a local-memory cache, which is fine within a single process
+		patcher = patch('_1327.user_management.permissions.cache_is_shared', return_value=True)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_anonymous_user_permissions_are_shared(self):
+		document = self.document
+		assign_perm(document.view_permission_name, get_anonymous_user(), document)
+		self.assertTrue(get_anonymous_user_checker().has_perm(document.view_permission_name, document))
+
+		# nothing is read from the database once the permissions are cached
+		with self.assertNumQueries(0):
+			check = RequestPermissionChecker(self.user).get_anonymous_user_checker()
+			self.assertTrue(check.has_perm(document.view_permission_name, document))
+			self.assertFalse(check.has_perm(document.edit_permission_name, document))
+
+		remove_perm(document.view_permission_name, get_anonymous_user(), document)
+		self.assertFalse(get_anonymous_user_checker().has_perm(document.view_permission_name, document))
+
+	def test_ip_range_group_permissions_are_shared(self):
+		document = self.document
+		self.assertFalse(get_ip_range_group_checker(self.group.name).has_perm(document.view_permission_name, document))
+
+		assign_perm(document.view_permission_name, self.group, document)
+		with self.assertNumQueries(1):
+			self.assertTrue(get_ip_range_group_checker(self.group.name).has_perm(document.view_permission_name, document))
+		with self.assertNumQueries(0):
+			self.assertTrue(get_ip_range_group_checker(self.group.name).has_perm(document.view_permission_name, document))
+
+	def test_bulk_permission_changes_invalidate_shared_permissions(self):
+		document = self.document
+		assign_perm(document.view_permission_name, self.group, document)
+		self.assertTrue(get_ip_range_group_checker(self.group.name).has_perm(document.view_permission_name, document))
+
+		# updates of querysets send no signals, the generation has to be bumped explicitly
+		edit_permission = Permission.objects.get(codename=document.edit_permission_name.split('.')[1])
+		GroupObjectPermission.objects.filter(group=self.group).update(permission=edit_permission)
+		bump_permission_generation()
+		self.assertFalse(get_ip_range_group_checker(self.group.name).has_perm(document.view_permission_name, document))
+		self.assertTrue(get_ip_range_group_checker(self.group.name).has_perm(document.edit_permission_name, document))
+
+	def test_permissions_are_not_shared_in_local_memory_caches(self):
+		document = self.document
+		assign_perm(document.view_permission_name, get_anonymous_user(), document)
+		with patch('_1327.user_management.permissions.cache_is_shared', return_value=False):
+			# the permissions are read from the database every time
+			for __ in range(2):
+				with self.assertNumQueries(3):
+					self.assertTrue(get_anonymous_user_checker().has_perm(document.view_permission_name, document))
+
+	def test_rolled_back_permission_changes_are_not_shared(self):
+		document = self.document
+		with self.assertRaises(DatabaseError), transaction.atomic():
+			assign_perm(document.view_permission_name, get_anonymous_user(), document)
+			self.assertTrue(get_anonymous_user_checker().has_perm(document.view_permission_name, document))
+			raise DatabaseError
+		self.assertFalse(get_anonymous_user_checker().has_perm(document.view_permission_name, document))
+
+
 class GroupEditFormTests(WebTest):
 
 	def setUp(self):